@@ -14,8 +14,12 @@ import dash_html_components as html
 from dash.dependencies import Input, Output, State
 import dash_core_components as dcc
 import dash_bootstrap_components as dbc
+import fcntl
 import flask 
 import os
+import pickle
+import tempfile
+import time
 import base58
 import plotly.express as px
 
@@ -43,11 +47,63 @@ def get_providers():
     df = pd.DataFrame(df_data)
     return df
     
+class TransactionStore:
+    """Transactions matched by a MinaExplorer query, kept in a local file (in CACHE_DIR, the temp directory by default)
+    so that each update only asks for those above the highest block height seen so far. The query takes that height
+    as $height and a page size as $limit, and must select each transaction's hash and blockHeight, oldest first.
+    Every 'reconcile_interval' seconds, the last 'depth' blocks below that height are asked for again as well, and
+    replace what's stored for them, which drops any transaction whose block has stopped being canonical since."""
+
+    def __init__(self, name, query, page_size=10000, depth=290, reconcile_interval=None):
+        directory = os.environ.get("CACHE_DIR", tempfile.gettempdir())
+        self.path = os.path.join(directory, f"{name}-transactions.pickle")
+        self.query = query
+        self.page_size = page_size
+        self.depth = depth
+        self.reconcile_interval = reconcile_interval or int(os.environ.get("RECONCILE_INTERVAL", 3600))
+
+    def fetch(self, height):
+        """Return every transaction above the given block height, a page at a time"""
+        transactions = []
+        while True:
+            url = 'https://graphql.minaexplorer.com'
+            r = requests.post(url, json={'query': self.query, 'variables': {'height': height, 'limit': self.page_size}})
+            page = json.loads(r.text)["data"]["transactions"]
+            transactions.extend(page)
+            if len(page) < self.page_size:
+                return transactions
+            # Start the next page back at the last block on this one, in case its transactions were split between them
+            height = page[-1]["blockHeight"] - 1
+
+    def update(self):
+        """Bring the store up to date, and return every transaction in it, newest first"""
+        # One update at a time, whichever thread or worker it's from
+        with open(f"{self.path}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                with open(self.path, "rb") as store:
+                    transactions, reconciled = pickle.load(store)
+            except FileNotFoundError:
+                transactions, reconciled = {}, 0
+            height = max((transaction["blockHeight"] for transaction in transactions.values()), default=0)
+            if time.time() - reconciled > self.reconcile_interval:
+                height = max(0, height - self.depth)
+                transactions = {key: transaction for key, transaction in transactions.items()
+                                if transaction["blockHeight"] <= height}
+                reconciled = time.time()
+            for transaction in self.fetch(height):
+                transactions[transaction["hash"]] = transaction
+            temporary = f"{self.path}.{os.getpid()}"
+            with open(temporary, "wb") as store:
+                pickle.dump((transactions, reconciled), store)
+            os.replace(temporary, self.path)
+        return sorted(transactions.values(), key=lambda transaction: transaction["blockHeight"], reverse=True)
+
 def get_data(all=False):
     if all:
         query = """
-        query AllTransactions {
-  transactions(query: {canonical: true, receiver: {publicKey: "B62qm7vP2JPj1d8XDmGUiv3GtwAfzuaxrdNsiXdWmZ7QqXZtzpVyGPG"}}, sortBy: BLOCKHEIGHT_DESC, limit: 10000) {
+        query AllTransactions($height: Int!, $limit: Int!) {
+  transactions(query: {canonical: true, blockHeight_gt: $height, receiver: {publicKey: "B62qm7vP2JPj1d8XDmGUiv3GtwAfzuaxrdNsiXdWmZ7QqXZtzpVyGPG"}}, sortBy: BLOCKHEIGHT_ASC, limit: $limit) {
     from
     fee
     memo
@@ -58,8 +114,8 @@ def get_data(all=False):
 }
 """
     else:
-        query = """query NoMemos {
-  transactions(query: {canonical: true, receiver: {publicKey: "B62qm7vP2JPj1d8XDmGUiv3GtwAfzuaxrdNsiXdWmZ7QqXZtzpVyGPG"}, OR: [{memo: "E4YM2vTHhWEg66xpj52JErHUBU4pZ1yageL4TVDDpTTSsv8mK6YaH"}, {memo: "E4YVe5YCtgSZuaBo1RiwHFWqtPzV6Eur8xG6JnbzEigit5nZKobQG"}, {memo: "E4YPMFGbXxurEKfdfxFYvLmzivqyZtH65z4CbnAbVqJRiQkDtNu8J"}]}, sortBy: BLOCKHEIGHT_DESC, limit: 10000) {
+        query = """query NoMemos($height: Int!, $limit: Int!) {
+  transactions(query: {canonical: true, blockHeight_gt: $height, receiver: {publicKey: "B62qm7vP2JPj1d8XDmGUiv3GtwAfzuaxrdNsiXdWmZ7QqXZtzpVyGPG"}, OR: [{memo: "E4YM2vTHhWEg66xpj52JErHUBU4pZ1yageL4TVDDpTTSsv8mK6YaH"}, {memo: "E4YVe5YCtgSZuaBo1RiwHFWqtPzV6Eur8xG6JnbzEigit5nZKobQG"}, {memo: "E4YPMFGbXxurEKfdfxFYvLmzivqyZtH65z4CbnAbVqJRiQkDtNu8J"}]}, sortBy: BLOCKHEIGHT_ASC, limit: $limit) {
     id
     from
     to
@@ -71,15 +127,8 @@ def get_data(all=False):
   }
 }
 """    
-    url = 'https://graphql.minaexplorer.com'
-    r = requests.post(url, json={'query': query})
-    
-    json_data = json.loads(r.text)
-    
-    df_data = json_data["data"]["transactions"]
-    
-    
-    df = pd.json_normalize(df_data, sep="_")
+    store = TransactionStore("exchange-mistakes-all" if all else "exchange-mistakes-no-memos", query)
+    df = pd.json_normalize(store.update(), sep="_")
     df["fee"] = df.fee.map(lambda x: x/ (10 ** 9))
     df["amount"] = df.amount.map(lambda x: x/ (10 ** 9))
     return df
@@ -133,6 +182,95 @@ def generate_table(df):
 # In[ ]:
 
 
+import threading
+import traceback
+
+# Upstream data is cached in files shared by every gunicorn worker (in CACHE_DIR, the temp directory by default), so a
+# worker starts out serving the last good snapshot instead of waiting on MinaExplorer and CoinGecko, and once there is
+# a snapshot, no page waits on them again.
+class SharedCache:
+    """A value fetched from upstream, refreshed in the background once it is more than 'ttl' seconds old while the
+    stale value is still served. Only one refresh runs at a time across all the workers; whoever asks for one while
+    it's running waits for it and gets its result, rather than going upstream again."""
+
+    def __init__(self, name, fetch, ttl):
+        directory = os.environ.get("CACHE_DIR", tempfile.gettempdir())
+        self.path = os.path.join(directory, f"exchange-mistakes-{name}.pickle")
+        self.fetch = fetch
+        self.ttl = ttl
+        self.value = None
+        # When the snapshot in 'value' was written, and when this worker last set off a background refresh
+        self.loaded = 0
+        self.attempted = 0
+        self.lock = threading.Lock()
+
+    def modified(self):
+        try:
+            return os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return 0
+
+    def load(self):
+        """Return the latest snapshot, reading it in if another worker has written a newer one"""
+        modified = self.modified()
+        if modified > self.loaded:
+            with open(self.path, "rb") as snapshot:
+                self.value = pickle.load(snapshot)
+            self.loaded = modified
+        return self.value
+
+    def get(self):
+        """Return the cached value, only waiting on upstream if there isn't one yet"""
+        value = self.load()
+        if value is None:
+            return self.refresh()
+        if time.time() - self.loaded > self.ttl:
+            self.revalidate()
+        return value
+
+    def refresh(self, max_age=0):
+        """Fetch a new value, unless one no more than 'max_age' seconds old turns up while waiting for the lock"""
+        wanted = time.time() - max_age
+        with self.lock, open(f"{self.path}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if self.modified() >= wanted:
+                return self.load()
+            value = self.fetch()
+            temporary = f"{self.path}.{os.getpid()}"
+            with open(temporary, "wb") as snapshot:
+                pickle.dump(value, snapshot)
+            os.replace(temporary, self.path)
+            return self.load()
+
+    def revalidate(self):
+        """Refresh in the background, unless this worker already tried within the last 'ttl' seconds"""
+        now = time.time()
+        if now - self.attempted < self.ttl:
+            return
+        self.attempted = now
+        threading.Thread(target=self.background, daemon=True).start()
+
+    def background(self):
+        try:
+            self.refresh(self.ttl)
+        except Exception:
+            # Keep serving what we have; the next revalidate() tries again
+            traceback.print_exc()
+
+
+data_cache = SharedCache("data", get_data, int(os.environ.get("DATA_TTL", 300)))
+price_cache = SharedCache("price", get_price, int(os.environ.get("PRICE_TTL", 300)))
+# A "Refetch Data" click only goes upstream if the data is older than this
+refetch_max_age = int(os.environ.get("REFETCH_MAX_AGE", 30))
+
+# Get a refresh going straight away if there's no snapshot yet, or it's gone stale
+for cache in (data_cache, price_cache):
+    if time.time() - cache.modified() > cache.ttl:
+        cache.revalidate()
+
+# In[ ]:
+
+
 app = JupyterDash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
 
 
@@ -204,88 +342,93 @@ Chain data is sourced _live_ from [Mina Explorer](https://minaexplorer.com) and
 Pricing data from [CoinGecko](https://www.coingecko.com).
 '''
 
-df = get_data()
-total_stuck_mina = df['amount'].sum()
-price = get_price()
-histogram = px.histogram(df, x="blockHeight", title="Transaction Frequency")
-
 app.title = "MINA Exchange Mistakes"
-app.layout= html.Div(className="container", children=[
-    html.Div(className="row", children=[
-        html.Div(className="col-xl-1"),
-        html.Div(className="col-xl", children=[
-            dcc.Markdown(app_copy)
-        ]),
-        html.Div(className="col-xl-1")
-    ]),
-    html.Div(className="row justify-content-md-center", children=[
-        html.Div(className="col-xl-3 card mr-5", children=[
-            html.Div(className="card-body", children=[
-                html.H6(className="card-title", children=[
-                    f"Total Stuck Funds:"
-                ]),
-                html.H5(children=[
-                   f"{total_stuck_mina:,.{3}f} $MINA"
-                ],style={
-                     "textAlign": "center"
-                })
+
+def serve_layout():
+    """Build the page from the cached data, so every page load shows the latest snapshot"""
+    df = data_cache.get()
+    total_stuck_mina = df['amount'].sum()
+    price = price_cache.get()
+    histogram = px.histogram(df, x="blockHeight", title="Transaction Frequency")
+
+    return html.Div(className="container", children=[
+        html.Div(className="row", children=[
+            html.Div(className="col-xl-1"),
+            html.Div(className="col-xl", children=[
+                dcc.Markdown(app_copy)
             ]),
+            html.Div(className="col-xl-1")
         ]),
-        html.Div(className="col-xl-3 card mr-5", children=[
-            html.Div(className="card-body", children=[
-                html.H6(className="card-title", children=[
-                    f"Market Price of Funds:"
-                ]),
-                html.H4(children=[
-                   f"${price * total_stuck_mina:,.{3}f}"
-                ],style={
-                     "textAlign": "center"
-                }),
-                html.Small(className="card-subtitle", children=[
-                   f"Market Rate: ${price}" 
+        html.Div(className="row justify-content-md-center", children=[
+            html.Div(className="col-xl-3 card mr-5", children=[
+                html.Div(className="card-body", children=[
+                    html.H6(className="card-title", children=[
+                        f"Total Stuck Funds:"
+                    ]),
+                    html.H5(children=[
+                       f"{total_stuck_mina:,.{3}f} $MINA"
+                    ],style={
+                         "textAlign": "center"
+                    })
                 ]),
             ]),
-        ]),
-        html.Div(className="col-xl-3 card", children=[
-            html.Div(className="card-body", children=[
-                html.P(children=[
-                    f"Total Transactions:"
+            html.Div(className="col-xl-3 card mr-5", children=[
+                html.Div(className="card-body", children=[
+                    html.H6(className="card-title", children=[
+                        f"Market Price of Funds:"
+                    ]),
+                    html.H4(children=[
+                       f"${price * total_stuck_mina:,.{3}f}"
+                    ],style={
+                         "textAlign": "center"
+                    }),
+                    html.Small(className="card-subtitle", children=[
+                       f"Market Rate: ${price}" 
+                    ]),
                 ]),
-                html.H2(children=[
-                   f"{len(df.index):,}"
-                ],style={
-                     "textAlign": "center"
-                })
             ]),
-        ])
-    ]),
+            html.Div(className="col-xl-3 card", children=[
+                html.Div(className="card-body", children=[
+                    html.P(children=[
+                        f"Total Transactions:"
+                    ]),
+                    html.H2(children=[
+                       f"{len(df.index):,}"
+                    ],style={
+                         "textAlign": "center"
+                    })
+                ]),
+            ])
+        ]),
     
-    html.Hr(),
-    html.Div(className="row", children=[
-        html.Div(className="col-xl-2"),
-        html.Div(className="col-xl", children=[
-            html.Div(id="table-container", children=[
-                generate_table(df)
+        html.Hr(),
+        html.Div(className="row", children=[
+            html.Div(className="col-xl-2"),
+            html.Div(className="col-xl", children=[
+                html.Div(id="table-container", children=[
+                    generate_table(df)
+                ]),
             ]),
+            html.Div(className="col-xl-2")
+        ]),
+        html.Div(className="row", children=[
+            html.Button(id='refetch-button', className=".mt-2", n_clicks=0, children='Refetch Data'),
         ]),
-        html.Div(className="col-xl-2")
-    ]),
-    html.Div(className="row", children=[
-        html.Button(id='refetch-button', className=".mt-2", n_clicks=0, children='Refetch Data'),
-    ]),
-    html.Div(className="row", children=[
-        dcc.Graph(id="histogram", className="mx-auto", figure=histogram)
-    ]),
-    html.Div(id="footer", className="row", children=[
-        html.Div(className="col-xl", 
-                 style={
-                     "textAlign": "center"
-                 },
-                 children=[
-            dcc.Markdown(footer_copy)
+        html.Div(className="row", children=[
+            dcc.Graph(id="histogram", className="mx-auto", figure=histogram)
+        ]),
+        html.Div(id="footer", className="row", children=[
+            html.Div(className="col-xl", 
+                     style={
+                         "textAlign": "center"
+                     },
+                     children=[
+                dcc.Markdown(footer_copy)
+            ])
         ])
     ])
-])
+
+app.layout = serve_layout
 
 # For Gunicorn
 server = app.server
@@ -299,7 +442,8 @@ def favicon():
               Input('refetch-button', 'n_clicks')
 )
 def refetch_data(n_clicks):
-    df = get_data()
+    # Dash also calls this when the page loads, which the cache can answer by itself
+    df = data_cache.refresh(refetch_max_age) if n_clicks else data_cache.get()
     return generate_table(df)
 
 if __name__ == "__main__":
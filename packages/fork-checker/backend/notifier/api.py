@@ -0,0 +1,272 @@
+# Read API over the notifier's staged forks, so clients can fetch just the forks they display instead of the whole tree.
+# Usage: python api.py
+# Serves on API_PORT (default 8080), reading the same SNAPSHOT and ARCHIVE files as the notifier, which it checks for
+# changes every API_REFRESH seconds (default 5). Forks are served in the layout they're staged in, plus their ID:
+#   GET /forks       Forks, most recently updated first. Filtered by min_length, updated_after and updated_before
+#                    (timestamps in milliseconds, both exclusive) and creator (any block in the fork), with at most
+#                    'limit' forks to a page (API_PAGE_SIZE, default 1000). When there are more, the Link header points
+#                    at the next page. With summary=1, the forks are listed without their blocks.
+#   GET /fork/{id}   A single fork, looked up in the archive if it isn't staged (any more).
+#   GET /producers/{public key}, GET /epochs/{epoch}
+#                    A block producer's or an epoch's statistics (see Statistics in notifier.py).
+# Every response carries an ETag, answers If-None-Match with 304 Not Modified, and is gzipped for clients that accept
+# it. Rendered responses are cached until the staged forks change.
+
+# Imports
+from bisect import bisect_left, bisect_right
+import gzip
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import notifier
+import os
+from store import Archive, Snapshot
+import threading
+import traceback
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+# Responses smaller than this aren't worth compressing
+COMPRESS_MIN = 1024
+
+
+# Returns a fork as the API serves it: its staged layout, with its ID, and optionally without its blocks.
+def present(fork_id, fork, summary=False):
+    fork = {key: value for key, value in fork.items() if not (summary and key == "blocks")}
+    fork["id"] = fork_id
+    return fork
+
+
+# Read-only set of forks, indexed by ID, by last update and by the creators of their blocks, along with the producer
+# statistics staged with them. A new index is built whenever any of them change and swapped in whole, so a request
+# never sees one half-built. Rendered responses are cached on the index they were rendered from, and go with it.
+class ForkIndex:
+    def __init__(self, forks, statistics=None, generation=None):
+        self.forks = forks
+        self.statistics = statistics or notifier.Statistics()
+        self.generation = generation
+        # (last_updated, ID) of every fork, and of every fork each creator has a block in, oldest first
+        self.order = sorted((fork["last_updated"], fork_id) for fork_id, fork in forks.items())
+        self.creators = {}
+        for key in self.order:
+            for creator in set(forks[key[1]]["blocks"]["creator"]):
+                self.creators.setdefault(creator, []).append(key)
+        self.responses = {}
+        self.limit = int(os.environ.get("API_CACHE_SIZE", 1024))
+        self.lock = threading.Lock()
+
+    # Returns up to 'limit' forks, newest first, that match the given filters and come after the given cursor (the
+    # (last_updated, ID) of the last fork on the previous page), along with the cursor for the next page, if any.
+    def query(self, creator=None, after=None, before=None, min_length=0, limit=1000, cursor=None):
+        order = self.order if creator is None else self.creators.get(creator, [])
+        low = 0 if after is None else bisect_right(order, (after, chr(0x10ffff)))
+        high = len(order) if before is None else bisect_left(order, (before,))
+        if cursor is not None:
+            high = min(high, bisect_left(order, cursor))
+        found = []
+        for position in range(high - 1, low - 1, -1):
+            fork = self.forks[order[position][1]]
+            if fork["length"] >= min_length:
+                if len(found) == limit:
+                    return found, (found[-1][1]["last_updated"], found[-1][0])
+                found.append((order[position][1], fork))
+        return found, None
+
+    # Returns the cached response for the given request path, or renders and caches it with 'render'.
+    def response(self, path, render):
+        response = self.responses.get(path)
+        if response is None:
+            response = Response(*render())
+            if response.status == 200:
+                with self.lock:
+                    if len(self.responses) >= self.limit:
+                        del self.responses[next(iter(self.responses))]
+                    self.responses[path] = response
+        return response
+
+
+# A rendered response: its status, JSON body, weak ETag (shared by the plain and gzipped bodies) and extra headers.
+class Response:
+    def __init__(self, status, value, headers=None):
+        self.status = status
+        self.body = json.dumps(value, separators=(",", ":")).encode("utf-8")
+        self.etag = f'W/"{hashlib.md5(self.body).hexdigest()}"'
+        self.headers = headers or {}
+        self.compressed = None
+
+    # Returns the gzipped body, compressing it the first time it's asked for.
+    def gzipped(self):
+        if self.compressed is None:
+            self.compressed = gzip.compress(self.body)
+        return self.compressed
+
+
+# Keeps a ForkIndex up to date with the snapshot and the archive. The staged forks are reloaded whenever the notifier
+# writes them; archived forks never change, so only those archived since the last refresh are read.
+class ForkSource:
+    def __init__(self, snapshot_path=None, archive_path=None):
+        self.snapshot = Snapshot(snapshot_path or os.environ.get("SNAPSHOT", "snapshot.sqlite"))
+        self.archive_path = archive_path or os.environ.get("ARCHIVE", "archive.sqlite")
+        self.archived = {}
+        self.archived_row = 0
+        self.index = ForkIndex({})
+        self.lock = threading.Lock()
+
+    # Rebuilds the index if anything changed since the last time. Returns whether it did.
+    def refresh(self):
+        with self.lock:
+            generation = tuple(self.snapshot.generation(name) for name in ("staged", "segments", "statistics"))
+            archived = 0
+            if os.path.exists(self.archive_path):
+                cold = Archive(self.archive_path)
+                for row, fork_id, fork in cold.added(self.archived_row):
+                    self.archived[fork_id] = fork
+                    self.archived_row = row
+                    archived += 1
+                cold.close()
+            if generation == self.index.generation and not archived:
+                return False
+            staged = self.snapshot.load("staged", {})
+            segments = self.snapshot.load("segments", {})
+            forks = dict(self.archived)
+            forks.update((fork_id, notifier.expand(fork, segments)) for fork_id, fork in staged.items())
+            self.index = ForkIndex(forks, self.snapshot.load("statistics"), generation)
+            return True
+
+    # Returns a single fork by its ID, going to the archive if the index doesn't have it (yet), or None.
+    def fork(self, index, fork_id):
+        fork = index.forks.get(fork_id)
+        if fork is None and os.path.exists(self.archive_path):
+            cold = Archive(self.archive_path)
+            fork = cold.fork(fork_id)
+            cold.close()
+        return fork
+
+
+class Handler(BaseHTTPRequestHandler):
+    source = None
+
+    def do_GET(self):
+        index = self.source.index
+        try:
+            response = index.response(self.path, lambda: self.route(index))
+        except ValueError as error:
+            response = Response(400, {"error": str(error)})
+        except Exception:
+            traceback.print_exc()
+            response = Response(500, {"error": "Internal error"})
+        self.send(response)
+
+    # Works out the response to a request from the given index, as (status, value, headers).
+    def route(self, index):
+        url = urlsplit(self.path)
+        if url.path == "/forks":
+            query = parse_qs(url.query)
+            creator = query.get("creator", [None])[0]
+            after = number(query, "updated_after")
+            before = number(query, "updated_before")
+            min_length = number(query, "min_length") or 0
+            page_size = int(os.environ.get("API_PAGE_SIZE", 1000))
+            limit = number(query, "limit")
+            if limit is not None and limit < 1:
+                raise ValueError(f"limit should be at least 1, not {limit}")
+            limit = min(limit or page_size, page_size)
+            cursor = query.get("cursor", [None])[0]
+            if cursor is not None:
+                last_updated, _, fork_id = cursor.partition(".")
+                cursor = (int(last_updated), fork_id)
+            summary = query.get("summary", ["0"])[0] not in ("", "0")
+            found, following = index.query(creator, after, before, min_length, limit, cursor)
+            headers = {}
+            if following is not None:
+                query["cursor"] = [f"{following[0]}.{following[1]}"]
+                headers["Link"] = f'<{url.path}?{urlencode(query, doseq=True)}>; rel="next"'
+            return 200, [present(fork_id, fork, summary) for fork_id, fork in found], headers
+        if url.path.startswith("/fork/"):
+            fork_id = url.path[len("/fork/"):]
+            fork = self.source.fork(index, fork_id)
+            if fork is None:
+                return 404, {"error": f"No fork {fork_id}"}
+            return 200, present(fork_id, fork)
+        if url.path.startswith("/producers/"):
+            creator = url.path[len("/producers/"):]
+            if creator not in index.statistics.producers:
+                return 404, {"error": f"No blocks from {creator}"}
+            return 200, index.statistics.producer(creator)
+        if url.path.startswith("/epochs/"):
+            epoch = url.path[len("/epochs/"):]
+            if not epoch.isdigit():
+                raise ValueError(f"The epoch should be a number, not {epoch!r}")
+            return 200, index.statistics.epoch(epoch)
+        return 404, {"error": f"No route {url.path}"}
+
+    def send(self, response):
+        matches = [tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")]
+        if response.status == 200 and (response.etag in matches or "*" in matches):
+            self.send_response(304)
+            self.send_common(response)
+            self.end_headers()
+            return
+        body = response.body
+        compressed = "gzip" in self.headers.get("Accept-Encoding", "") and len(body) >= COMPRESS_MIN
+        if compressed:
+            body = response.gzipped()
+        self.send_response(response.status)
+        self.send_common(response)
+        self.send_header("Content-Type", "application/json")
+        if compressed:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in response.headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Headers that go with a response whether or not its body is sent.
+    def send_common(self, response):
+        self.send_header("ETag", response.etag)
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Vary", "Accept-Encoding")
+        self.send_header("Access-Control-Allow-Origin", os.environ.get("API_ORIGIN", "*"))
+        self.send_header("Access-Control-Expose-Headers", "ETag, Link")
+
+
+# Returns the named query parameter as an integer, or None if it isn't given. Raises ValueError if it isn't a number.
+def number(query, name):
+    value = query.get(name, [""])[0]
+    if value == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} should be a number, not {value!r}")
+
+
+def refresher(source, interval, stopping):
+    while not stopping.wait(interval):
+        try:
+            source.refresh()
+        except Exception:
+            traceback.print_exc()
+
+
+def main():
+    Handler.source = ForkSource()
+    Handler.source.refresh()
+    stopping = threading.Event()
+    interval = float(os.environ.get("API_REFRESH", 5))
+    thread = threading.Thread(target=refresher, args=(Handler.source, interval, stopping), name="refresher",
+                              daemon=True)
+    thread.start()
+    server = ThreadingHTTPServer(("", int(os.environ.get("API_PORT", 8080))), Handler)
+    print(f"Serving {len(Handler.source.index.forks)} forks on port {server.server_port}.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stopping.set()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+# Imports
+from firebase_admin import credentials, initialize_app, db
+import os
+import threading
+
+
+# Destinations for staged forks. A backend only has to apply a multi-path update: a dict mapping paths (relative to the
+# backend's root, separated by '/') to the value that should now live there, with None meaning delete.
+
+# Keeps everything in a plain dict. Useful for testing, or for running the notifier without a database at all.
+class MemoryBackend:
+    def __init__(self):
+        self.data = {}
+        self.updates = []
+
+    def update(self, changes):
+        self.updates.append(changes)
+        for path, value in changes.items():
+            node = self.data
+            parts = path.split("/")
+            for part in parts[:-1]:
+                node = node.setdefault(part, {})
+            if value is None:
+                node.pop(parts[-1], None)
+            else:
+                node[parts[-1]] = value
+
+
+# Writes to a FireBase realtime database, under the given root reference.
+# The FireBase app (and with it, its connections) is initialized once and then shared by every backend in the process,
+# whichever thread gets there first. Setting the FIREBASE_DATABASE_EMULATOR_HOST environment variable points it at a
+# local emulator instead of the real database.
+class FirebaseBackend:
+    app = None
+    lock = threading.Lock()
+
+    def __init__(self, root="forks"):
+        with FirebaseBackend.lock:
+            if FirebaseBackend.app is None:
+                environment = os.environ.get("ENV", "DEV")
+                url = os.environ.get("DB_URL", "https://sv-mina-forks-default-rtdb.firebaseio.com/")
+                if environment == "DEV":
+                    cred = credentials.Certificate('service_account.json')
+                    FirebaseBackend.app = initialize_app(cred, options={'databaseURL': url})
+                else:
+                    FirebaseBackend.app = initialize_app(options={'databaseURL': url})
+        self.reference = db.reference(root, app=FirebaseBackend.app)
+
+    def update(self, changes):
+        self.reference.update(changes)
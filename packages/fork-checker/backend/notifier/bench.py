@@ -0,0 +1,126 @@
+# Benchmark harness for the notifier pipeline, run against synthetic chains (see synthetic.py).
+# Usage: python bench.py [--scales 10000 100000 1000000] [--cycles N] [--increment N] [--output FILE] [--compare FILE]
+# For each scale, a chain of that many blocks is written to a local directory standing in for the bucket. Every stage
+# is timed on a cold run over the whole chain, then over a number of incremental cycles that each add a few new blocks.
+# Results are saved as JSON, tagged with the current commit, and can be compared against an earlier results file.
+
+# Imports
+import argparse
+from backends import MemoryBackend
+import itertools
+import json
+import notifier
+import os
+import platform
+import subprocess
+import synthetic
+import tempfile
+import time
+
+STAGES = ("download", "parse", "blockmap", "paint", "tally", "process", "prestage", "firebase_update", "archive")
+
+
+# Runs one pass of the pipeline, timing each stage. Works in the current directory, like the notifier itself.
+def cycle(backend):
+    timings = {}
+
+    def timed(stage, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        timings[stage] = time.perf_counter() - start
+        return result
+
+    files = timed("download", notifier.download)
+    master, new_files = timed("parse", notifier.parse, files)
+    blockchain = timed("blockmap", notifier.blockmap, master)
+    event = timed("paint", notifier.paint, blockchain)
+    timed("tally", notifier.tally, blockchain, master, event)
+    forks = timed("process", notifier.process, blockchain)
+    staging = timed("prestage", notifier.prestage, forks, master, blockchain)
+    uploaded, size = timed("firebase_update", notifier.firebase_update, staging, backend)
+    archived_blocks, archived_forks = timed("archive", notifier.archive, blockchain)
+    return {"stages": timings, "total": sum(timings.values()), "new_blocks": new_files,
+            "blocks": len(blockchain.blocks), "forks": len(forks), "staged": len(staging),
+            "uploaded_forks": uploaded, "uploaded_bytes": size, "archived_blocks": archived_blocks,
+            "archived_forks": archived_forks}
+
+
+# Benchmarks a single scale: one cold run, then 'cycles' incremental runs of 'increment' new blocks each.
+def scale(blocks, cycles, increment, options):
+    arrivals = synthetic.chain(blocks + cycles * increment, options.fork_rate, options.fork_depth,
+                               options.supercharge, seed=options.seed, padding=synthetic.padding(options.size))
+    runs = []
+    directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)
+        os.environ["BUCKET_NAME"] = os.path.join(scratch, "bucket")
+        os.environ["OUTPUT_DIR"] = os.path.join(scratch, "blocks")
+        backend = MemoryBackend()
+        try:
+            synthetic.write(os.environ["BUCKET_NAME"], itertools.islice(arrivals, blocks))
+            run = cycle(backend)
+            runs.append({"scale": blocks, "mode": "cold", **run})
+            print(f"{blocks:>9} cold        {run['total']:9.3f}s  {describe(run)}")
+            for i in range(cycles):
+                synthetic.write(os.environ["BUCKET_NAME"], itertools.islice(arrivals, increment))
+                run = cycle(backend)
+                runs.append({"scale": blocks, "mode": "incremental", "cycle": i + 1, **run})
+                print(f"{blocks:>9} cycle {i + 1:<5} {run['total']:9.3f}s  {describe(run)}")
+        finally:
+            os.chdir(directory)
+    return runs
+
+
+def describe(run):
+    return "  ".join(f"{stage}={run['stages'][stage]:.3f}" for stage in STAGES)
+
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+# Prints how each stage's time changed against an earlier results file, matching runs by scale, mode and cycle.
+def compare(runs, baseline):
+    with open(baseline, "r") as baseline_file:
+        previous = {(run["scale"], run["mode"], run.get("cycle")): run for run in json.load(baseline_file)["runs"]}
+    for run in runs:
+        old = previous.get((run["scale"], run["mode"], run.get("cycle")))
+        if old is None:
+            continue
+        changes = "  ".join(f"{stage}={run['stages'][stage] / old['stages'][stage]:.2f}x" for stage in STAGES
+                            if old["stages"].get(stage))
+        print(f"{run['scale']:>9} {run['mode']:<11} {changes}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the notifier pipeline on synthetic chains.")
+    parser.add_argument("--scales", type=int, nargs="+", default=[10000, 100000, 1000000], help="chain sizes")
+    parser.add_argument("--cycles", type=int, default=5, help="incremental cycles after each cold run")
+    parser.add_argument("--increment", type=int, default=10, help="new blocks per incremental cycle")
+    parser.add_argument("--fork-rate", type=float, default=0.05)
+    parser.add_argument("--fork-depth", type=int, default=3)
+    parser.add_argument("--supercharge", type=float, default=0.5)
+    parser.add_argument("--size", type=int, default=0, help="approximate padding per block, in KB")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark.json", help="where to save the results")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    options = parser.parse_args()
+
+    runs = []
+    for blocks in options.scales:
+        runs.extend(scale(blocks, options.cycles, options.increment, options))
+    results = {"commit": commit(), "timestamp": int(time.time()), "python": platform.python_version(),
+               "options": vars(options), "runs": runs}
+    with open(options.output, "w") as output:
+        json.dump(results, output, indent=4)
+    print(f"Saved results to {options.output}")
+    if options.compare:
+        compare(runs, options.compare)
+
+
+if __name__ == '__main__':
+    main()
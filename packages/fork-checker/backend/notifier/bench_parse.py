@@ -0,0 +1,50 @@
+# Benchmark for parse(): compares the original whole-file json.loads path against the prefix-limited extractor, both
+# serially and across a process pool.
+# Usage: python bench_parse.py [--dir BLOCK_DIR] [--count N] [--size KB] [--workers N]
+# Without --dir, N synthetic blocks of roughly the given size are written to a temporary directory first.
+
+# Imports
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from notifier import extract, extract_full
+import os
+import synthetic
+import tempfile
+import time
+
+
+def timed(label, function, files):
+    start = time.time()
+    results = function(files)
+    end = time.time()
+    print(f"{label:<32} {end - start:8.3f} seconds  ({len(files) / (end - start):10.1f} blocks/second)")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark block parsing strategies.")
+    parser.add_argument("--dir", help="directory of existing block files to parse")
+    parser.add_argument("--count", type=int, default=2000, help="number of synthetic blocks to generate")
+    parser.add_argument("--size", type=int, default=200, help="approximate size of each synthetic block, in KB")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="process pool size")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        if args.dir:
+            files = [os.path.join(args.dir, name) for name in os.listdir(args.dir)]
+        else:
+            files = synthetic.write(scratch, synthetic.chain(args.count, fork_rate=0,
+                                                              padding=synthetic.padding(args.size)))
+
+        full = timed("full json.loads, serial", lambda f: [extract_full(file) for file in f], files)
+        prefix = timed("prefix extraction, serial", lambda f: [extract(file) for file in f], files)
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            chunksize = max(1, len(files) // (args.workers * 4))
+            pooled = timed(f"prefix extraction, {args.workers} workers",
+                           lambda f: list(pool.map(extract, f, chunksize=chunksize)), files)
+        if not full == prefix == pooled:
+            print("WARNING: parsing strategies disagree on the extracted fields!")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# Shared fixtures for the notifier's tests, which run the pipeline against synthetic chains (see synthetic.py).
+# Usage: python -m pytest (from this directory)
+
+# Imports
+from backends import MemoryBackend
+import bench
+import notifier
+import os
+import pytest
+import random
+import synthetic
+
+# Settings that change what a cycle does, cleared so the tests don't pick them up from the environment
+SETTINGS = ("MASTER", "STORE", "MANIFEST", "SNAPSHOT", "ARCHIVE", "BLOCKCHAIN", "STAGING", "LATEST", "FINALITY",
+            "PARSE_WORKERS", "STAGE_WORKERS", "CYCLE_MAX_FILES", "UPLOAD_SEGMENTS", "UPLOAD_STATISTICS",
+            "UPLOAD_BATCH_BYTES", "METRICS_FILE")
+
+
+# Runs the pipeline in a directory of its own, with a directory standing in for the bucket. Blocks are dropped into the
+# bucket with add(), and run() takes them through one cycle, uploading to a MemoryBackend.
+class Pipeline:
+    def __init__(self, directory):
+        self.bucket = os.path.join(directory, "bucket")
+        self.backend = MemoryBackend()
+        os.makedirs(self.bucket)
+
+    def add(self, blocks):
+        return synthetic.write(self.bucket, blocks)
+
+    def run(self):
+        return bench.cycle(self.backend)
+
+    # Adds the blocks in batches of 'batch', running a cycle after each. Returns the results of every cycle.
+    def feed(self, blocks, batch):
+        blocks = list(blocks)
+        results = []
+        for start in range(0, len(blocks), batch):
+            self.add(blocks[start:start + batch])
+            results.append(self.run())
+        return results
+
+    def snapshot(self):
+        return notifier.snapshot()
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    for name in SETTINGS:
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("BUCKET_NAME", str(tmp_path / "bucket"))
+    monkeypatch.setenv("OUTPUT_DIR", str(tmp_path / "blocks"))
+    monkeypatch.setattr(notifier, "resident", None)
+    return Pipeline(str(tmp_path))
+
+
+# Returns a synthetic chain's blocks in the order they'd arrive, shuffled within windows of 'window' blocks when given,
+# so that children turn up before their parents and late blocks cause reorgs.
+def arrivals(length, window=0, seed=0, **options):
+    blocks = list(synthetic.chain(length, seed=seed, **options))
+    if window:
+        generator = random.Random(seed)
+        for start in range(0, len(blocks), window):
+            part = blocks[start:start + window]
+            generator.shuffle(part)
+            blocks[start:start + window] = part
+    return blocks
@@ -0,0 +1,39 @@
+# Converts the notifier's existing state files to the current formats: a legacy master.json is imported into the block
+# store, and the blockchain - from a snapshot that still holds it pickled, or a legacy mapping.pickle - is caught up on
+# the store and saved back to the snapshot as a mapped chain file.
+# Usage: python convert.py [--master master.json] [--pickle mapping.pickle] [--output FILE]
+# With --output, a standalone copy of the chain file is written there as well, e.g. to share between machines.
+# The usual STORE and SNAPSHOT environment variables apply.
+
+# Imports
+import argparse
+import notifier
+import os
+from store import BlockStore
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the notifier's state files to the current formats.")
+    parser.add_argument("--master", default=os.environ.get("MASTER", "master.json"), help="legacy master.json")
+    parser.add_argument("--pickle", default=os.environ.get("BLOCKCHAIN", "mapping.pickle"),
+                        help="legacy pickled blockchain, used if the snapshot doesn't have one")
+    parser.add_argument("--output", help="where to write a standalone copy of the chain file")
+    args = parser.parse_args()
+
+    start = time.time()
+    master = BlockStore(os.environ.get("STORE", "blocks.sqlite"))
+    imported = master.migrate(args.master)
+    os.environ["BLOCKCHAIN"] = args.pickle
+    blockchain = notifier.blockmap(master)
+    notifier.snapshot().save(blockchain=blockchain)
+    if args.output:
+        blockchain.dump(args.output)
+    master.close()
+    end = time.time()
+    print(f"Imported {imported} Blocks from {args.master}, saved a chain of {len(blockchain.blocks)} Blocks in "
+          f"{end - start} seconds.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+# Long-running notifier: instead of one powercycle() per process, this keeps a single process cycling on a schedule.
+# Usage: python daemon.py
+# Configured through CYCLE_INTERVAL (seconds between the starts of cycles, default 60) and CHECKPOINT_INTERVAL (seconds
+# between checkpoints, default 600), on top of the notifier's usual environment variables. If METRICS_PORT is set, the
+# pipeline metrics are served over HTTP on that port.
+
+# Imports
+import metrics
+import notifier
+import os
+import signal
+from store import Snapshot
+import threading
+import time
+import traceback
+
+
+# The blockchain, staged forks and everything else in the snapshot stay resident in memory between cycles. They are
+# written back to disk by periodic checkpoints on a background thread, and once more on shutdown, rather than after
+# every stage. Cycles never overlap: they run one after another, and a cycle that overruns its slot makes the daemon
+# skip the ticks it missed. A cycle that comes round while a checkpoint is pickling the state waits for it to finish.
+class Daemon:
+    def __init__(self, interval=None, checkpoint_interval=None, printout=True):
+        self.interval = interval or float(notifier.setting("CYCLE_INTERVAL", 60))
+        self.checkpoint_interval = checkpoint_interval or float(notifier.setting("CHECKPOINT_INTERVAL", 600))
+        self.printout = printout
+        self.path = notifier.location("SNAPSHOT", "snapshot.sqlite")
+        self.snapshot = Snapshot(self.path, resident=True)
+        # Held for the whole of a cycle, and while a checkpoint is pickling the state, so neither sees the other
+        # halfway. Whichever comes second waits for the other; nothing is skipped for it
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.cycles = 0
+        self.skipped = 0
+
+    # Runs a single cycle, once any checkpoint in progress is done with the state.
+    def cycle(self):
+        with self.lock:
+            try:
+                notifier.powercycle(printout=self.printout)
+                self.cycles += 1
+            except Exception:
+                # A failed cycle shouldn't take the daemon down with it; the next one will pick up where this left off
+                traceback.print_exc()
+
+    # Writes any sections changed since the last checkpoint to disk, and returns how many there were.
+    # Only the pickling needs the lock; the write goes through a connection of its own so cycles can carry on.
+    def checkpoint(self):
+        with self.lock:
+            blobs = self.snapshot.serialize({name: self.snapshot.sections[name] for name in self.snapshot.dirty})
+            self.snapshot.dirty.clear()
+        if blobs:
+            writer = Snapshot(self.path)
+            writer.write(blobs)
+            writer.close()
+        return len(blobs)
+
+    def checkpoints(self):
+        while not self.stopping.wait(self.checkpoint_interval):
+            try:
+                start = time.time()
+                written = self.checkpoint()
+                end = time.time()
+                if self.printout and written:
+                    print(f"Checkpointed {written} sections in {end - start} seconds.")
+            except Exception:
+                traceback.print_exc()
+
+    # Asks the daemon to stop once the current cycle (if any) has finished. Doubles as a signal handler.
+    def stop(self, *args):
+        self.stopping.set()
+
+    def run(self):
+        if os.environ.get("METRICS_PORT"):
+            metrics.serve(int(os.environ["METRICS_PORT"]))
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        checkpointer = threading.Thread(target=self.checkpoints, name="checkpoints", daemon=True)
+        checkpointer.start()
+
+        notifier.resident = self.snapshot
+        start = time.monotonic()
+        tick = 0
+        while not self.stopping.is_set():
+            self.cycle()
+            # Cycles start on a fixed grid of ticks; any ticks that went by during the cycle are skipped, not queued up
+            due = int((time.monotonic() - start) // self.interval) + 1
+            if due > tick + 1:
+                self.skipped += due - tick - 1
+                if self.printout:
+                    print(f"Cycle overran its interval, skipping {due - tick - 1} cycles.")
+            tick = due
+            self.stopping.wait(max(0, start + tick * self.interval - time.monotonic()))
+
+        checkpointer.join()
+        written = self.checkpoint()
+        notifier.resident = None
+        if self.printout:
+            print(f"Stopped after {self.cycles} cycles ({self.skipped} skipped), checkpointed {written} sections.")
+
+
+if __name__ == '__main__':
+    Daemon().run()
@@ -0,0 +1,100 @@
+# Imports
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import requests
+from requests.adapters import HTTPAdapter
+import sqlite3
+import threading
+import time
+from urllib3.util.retry import Retry
+
+
+# Returns a session that pools up to 'workers' connections to each of up to 'hosts' hosts, and retries requests with
+# backoff on connection errors and 5xx/429 responses.
+def pooled_session(workers, hosts=1, retries=3):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=hosts, pool_maxsize=workers,
+                          max_retries=Retry(total=retries, backoff_factor=0.5,
+                                            status_forcelist=(429, 500, 502, 503, 504)))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# Client for MinaExplorer's /blocks/{hash} endpoint, for filling in blocks missing from our own bucket.
+# Requests share one pooled session (at most 'workers' connections), are spread out to at most 'rate' per second, are
+# retried with backoff, and time out rather than hang. Blocks that were found are cached on disk for good - a block's
+# contents never change, so there's no reason to ask twice. Given a 'session', requests go through that instead, which
+# is left open on close() for whoever else shares it.
+class Explorer:
+    def __init__(self, url=None, cache=None, workers=None, rate=None, retries=3, timeout=10, session=None):
+        self.url = (url or os.environ.get("EXPLORER_URL", "https://api.minaexplorer.com")).rstrip("/")
+        self.workers = workers or int(os.environ.get("EXPLORER_WORKERS", 8))
+        self.interval = 1 / (rate or float(os.environ.get("EXPLORER_RATE", 10)))
+        self.timeout = timeout
+
+        self.shared = session is not None
+        self.session = session if self.shared else pooled_session(self.workers, retries=retries)
+
+        # Only the calling thread touches the cache; worker threads just make requests
+        self.cache = sqlite3.connect(cache or os.environ.get("EXPLORER_CACHE", "explorer.sqlite"))
+        self.cache.execute("CREATE TABLE IF NOT EXISTS blocks (state_hash TEXT PRIMARY KEY, response TEXT)")
+        self.cache.commit()
+
+        self.lock = threading.Lock()
+        self.next_request = 0
+
+    # Blocks the calling thread until it's allowed to make its request.
+    def throttle(self):
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_request - now
+            self.next_request = max(now, self.next_request) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+    # Requests a single block, bypassing the cache. Returns None if the explorer doesn't know the block or can't be
+    # reached.
+    def request(self, state_hash):
+        self.throttle()
+        try:
+            response = self.session.get(f"{self.url}/blocks/{state_hash}", timeout=self.timeout)
+            response.raise_for_status()
+            response = response.json()
+        except (requests.RequestException, ValueError):
+            return None
+        if not isinstance(response, dict) or not response.get("block"):
+            return None
+        return response
+
+    # Returns a dict mapping each of the given hashes to the explorer's response for it, leaving out any the explorer
+    # doesn't have. Cached blocks are returned straight away; the rest are fetched concurrently and then cached.
+    def blocks(self, state_hashes):
+        found = {}
+        missing = []
+        for state_hash in state_hashes:
+            row = self.cache.execute("SELECT response FROM blocks WHERE state_hash = ?", (state_hash,)).fetchone()
+            if row is not None:
+                found[state_hash] = json.loads(row[0])
+            else:
+                missing.append(state_hash)
+
+        if missing:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                for state_hash, response in zip(missing, pool.map(self.request, missing)):
+                    if response is not None:
+                        found[state_hash] = response
+                        self.cache.execute("INSERT OR REPLACE INTO blocks VALUES (?, ?)",
+                                           (state_hash, json.dumps(response)))
+            self.cache.commit()
+        return found
+
+    # Returns the explorer's response for one block, or None.
+    def block(self, state_hash):
+        return self.blocks([state_hash]).get(state_hash)
+
+    def close(self):
+        if not self.shared:
+            self.session.close()
+        self.cache.close()
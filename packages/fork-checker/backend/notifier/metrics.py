@@ -0,0 +1,63 @@
+# Imports
+import os
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, start_http_server, write_to_textfile
+import resource
+import time
+
+
+# Prometheus metrics for the notifier pipeline, kept in a registry of their own so only pipeline metrics get exported.
+# They can be served over HTTP (serve(), used by the daemon when METRICS_PORT is set) or written out as a text file
+# after each cycle for node_exporter's textfile collector (export(), when METRICS_FILE is set).
+REGISTRY = CollectorRegistry()
+BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+STAGE_SECONDS = Histogram("notifier_stage_duration_seconds", "Time spent in each pipeline stage.", ["stage"],
+                          buckets=BUCKETS, registry=REGISTRY)
+STAGE_ERRORS = Counter("notifier_stage_errors", "Pipeline stages that raised an exception.", ["stage"],
+                       registry=REGISTRY)
+NEW_BLOCKS = Counter("notifier_new_blocks", "Blocks parsed into the master.", registry=REGISTRY)
+UPLOADED_FORKS = Counter("notifier_uploaded_forks", "Forks sent to the database.", registry=REGISTRY)
+UPLOADED_BYTES = Counter("notifier_uploaded_bytes", "Bytes of fork data sent to the database.", registry=REGISTRY)
+ARCHIVED_BLOCKS = Counter("notifier_archived_blocks", "Final blocks moved to the archive.", registry=REGISTRY)
+ARCHIVED_FORKS = Counter("notifier_archived_forks", "Resolved forks moved to the archive.", registry=REGISTRY)
+FORKS = Gauge("notifier_forks", "Forks found by the most recent cycle.", registry=REGISTRY)
+STAGED_FORKS = Gauge("notifier_staged_forks", "Forks held in staging after the most recent cycle.", registry=REGISTRY)
+HOT_BLOCKS = Gauge("notifier_hot_blocks", "Blocks held in memory after the most recent cycle.", registry=REGISTRY)
+PEAK_RSS = Gauge("notifier_peak_rss_bytes", "Peak resident set size of the notifier process.", registry=REGISTRY)
+
+
+# Returns the peak resident set size of this process, in bytes (Linux reports ru_maxrss in kilobytes).
+def peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# Times a stage of the pipeline: records its duration and the peak RSS once it's done, and counts it as an error if it
+# raises. The elapsed time is kept in 'seconds' for anyone who wants to print it.
+class timed:
+    def __init__(self, stage):
+        self.stage = stage
+        self.seconds = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, kind, value, trace):
+        self.seconds = time.perf_counter() - self.start
+        STAGE_SECONDS.labels(self.stage).observe(self.seconds)
+        PEAK_RSS.set(peak_rss())
+        if kind is not None:
+            STAGE_ERRORS.labels(self.stage).inc()
+        return False
+
+
+# Starts serving the metrics over HTTP on a background thread.
+def serve(port):
+    start_http_server(port, registry=REGISTRY)
+
+
+# Writes the metrics to METRICS_FILE, if it's set.
+def export():
+    path = os.environ.get("METRICS_FILE")
+    if path:
+        write_to_textfile(path, REGISTRY)
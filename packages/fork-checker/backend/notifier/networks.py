@@ -0,0 +1,141 @@
+# Runs the notifier for several networks (mainnet, devnet, berkeley, ...) side by side in one process, rather than in a
+# container apiece: they share the start-up, a pool of worker processes, an HTTP session and a single scheduler, while
+# each keeps its own chain state and FireBase roots.
+# Usage: python networks.py
+# NETWORKS lists the networks to run, separated by commas (e.g. "mainnet,devnet,berkeley"). Each is configured through
+# the notifier's usual environment variables prefixed with its name in capitals (DEVNET_BUCKET_NAME, DEVNET_FINALITY,
+# DEVNET_CYCLE_INTERVAL, ...), falling back to the unprefixed ones and then to the usual defaults. Relative paths are
+# taken from the network's own directory (<NAME>_DIRECTORY, its name by default), and its FireBase roots go under its
+# name (devnet/forks, devnet/segments, ...) unless it has roots of its own, so no two networks share any state.
+# What they share, and how far each can go with it:
+#   POOL_WORKERS worker processes (default: one per CPU) parse and stage for every network. A network keeps at most its
+#   PARSE_WORKERS and STAGE_WORKERS of them busy at a time, so those have to be set for the pool to be used at all.
+#   NETWORK_THREADS cycles (default: one per network) run at a time. A network's own cycles never overlap.
+#   A network with a backlog parses at most CYCLE_MAX_FILES files a cycle (see powercycle() in notifier.py), so that
+#   catching up doesn't keep its cycles - and the threads they run on - busy for long.
+# CHECKPOINT_INTERVAL and METRICS_PORT work the same as for daemon.py. The metrics are those of every network together.
+
+# Imports
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from daemon import Daemon
+from explorer import pooled_session
+import heapq
+import metrics
+import multiprocessing
+import notifier
+import os
+import signal
+import threading
+import time
+import traceback
+
+
+# One network's pipeline. It keeps a daemon's resident snapshot, lock and checkpoints, but leaves running it to the
+# scheduler. Its cycles run with the network active, so every stage reads this network's settings and state.
+class Network(Daemon):
+    def __init__(self, name, printout=True):
+        self.name = name
+        self.prefix = f"{name.upper().replace('-', '_')}_"
+        self.directory = os.environ.get(f"{self.prefix}DIRECTORY", name)
+        os.makedirs(self.directory, exist_ok=True)
+        with self.active():
+            super().__init__(printout=printout)
+
+    # Makes this the network the notifier is working for, in the current thread.
+    @contextmanager
+    def active(self):
+        token = notifier.network.set(self)
+        try:
+            yield
+        finally:
+            notifier.network.reset(token)
+
+    def cycle(self):
+        with self.active():
+            if self.printout:
+                print(f"Cycling {self.name}.")
+            super().cycle()
+
+
+# Runs the networks' cycles and checkpoints on one schedule. Each network cycles on a grid of its own CYCLE_INTERVAL, as
+# the daemon does, and skips any tick that comes round while its last cycle is still running (or waiting for a thread).
+# Checkpoints are written one at a time on a thread of their own. A network's cycle that starts while its state is being
+# pickled for a checkpoint waits for that to finish, rather than being skipped.
+class Scheduler:
+    def __init__(self, networks, threads=None, workers=None, printout=True):
+        self.networks = networks
+        self.threads = threads or int(os.environ.get("NETWORK_THREADS", len(networks)))
+        self.workers = workers or int(os.environ.get("POOL_WORKERS", os.cpu_count() or 1))
+        self.printout = printout
+        self.stopping = threading.Event()
+
+    # Asks the scheduler to stop once the cycles in progress have finished. Doubles as a signal handler.
+    def stop(self, *args):
+        self.stopping.set()
+
+    def checkpoint(self, network):
+        try:
+            start = time.time()
+            written = network.checkpoint()
+            end = time.time()
+            if self.printout and written:
+                print(f"Checkpointed {written} sections of {network.name} in {end - start} seconds.")
+        except Exception:
+            traceback.print_exc()
+
+    def run(self):
+        if os.environ.get("METRICS_PORT"):
+            metrics.serve(int(os.environ["METRICS_PORT"]))
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        # Worker processes are started by a server process rather than forked from this one, whose other threads could
+        # be in the middle of anything at the time
+        notifier.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("forkserver"))
+        notifier.session = pooled_session(int(os.environ.get("EXPLORER_WORKERS", 8)), hosts=len(self.networks))
+        cycles = ThreadPoolExecutor(self.threads, thread_name_prefix="cycle")
+        checkpoints = ThreadPoolExecutor(1, thread_name_prefix="checkpoint")
+        running = {}
+
+        # What's due next, as (when, network's position, "cycle" or "checkpoint", network)
+        start = time.monotonic()
+        queue = []
+        for position, network in enumerate(self.networks):
+            queue.append((start, position, "cycle", network))
+            queue.append((start + network.checkpoint_interval, position, "checkpoint", network))
+        heapq.heapify(queue)
+        try:
+            while not self.stopping.wait(max(0, queue[0][0] - time.monotonic())):
+                when, position, task, network = heapq.heappop(queue)
+                if task == "checkpoint":
+                    checkpoints.submit(self.checkpoint, network)
+                    heapq.heappush(queue, (when + network.checkpoint_interval, position, task, network))
+                    continue
+                if network in running and not running[network].done():
+                    network.skipped += 1
+                else:
+                    running[network] = cycles.submit(network.cycle)
+                # Cycles that were due while this one was waiting its turn are skipped, not queued up
+                tick = int((time.monotonic() - start) // network.interval) + 1
+                heapq.heappush(queue, (start + tick * network.interval, position, task, network))
+        finally:
+            cycles.shutdown(cancel_futures=True)
+            checkpoints.shutdown()
+            for network in self.networks:
+                written = network.checkpoint()
+                if self.printout:
+                    print(f"Stopped {network.name} after {network.cycles} cycles ({network.skipped} skipped), "
+                          f"checkpointed {written} sections.")
+            notifier.pool.shutdown()
+            notifier.pool = None
+            notifier.session.close()
+            notifier.session = None
+
+
+def main():
+    names = [name.strip() for name in os.environ.get("NETWORKS", "mainnet").split(",") if name.strip()]
+    Scheduler([Network(name) for name in names]).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,505 +1,1618 @@
-# Imports
-from firebase_admin import credentials, firestore, initialize_app, db
-from glob import glob
-import hashlib
-import json
-import os
-from pathlib import Path
-import pickle
-import requests
-import subprocess
-import time
-
-
-# Progress bar. Just for visual fluff, can probably be removed.
-def progress(iteration, total, prefix='', suffix='', decimals=1, length=100, fill='█', end="\r"):
-    percent = ("{0:." + str(decimals) + "f}").format(100 * (iteration / float(total)))
-    filled = int(length * iteration // total)
-    bar = fill * filled + '-' * (length - filled)
-    print(f'\r{prefix} |{bar}| {percent}% {suffix}', end=end)
-    if iteration == total:
-        print()
-
-
-# Because I as of yet have not found a sufficient python library for this task, we're making our own classes.
-class Block:
-    def __init__(self, h='', p='', d=0, t='', c=None):
-        self.hash = h
-        self.parent = p
-        self.child = c
-        self.height = d
-        self.timestamp = t
-        self.canon = False
-
-
-# Basic structure that holds a dict of Block objects, and is able to perform work on them using the attributes as
-# defined in the Block class. Dict is used solely to speed things up, in spite of the mild clunkiness.
-class Blockchain:
-    def __init__(self):
-        self.blocks = {}
-
-    # Adds a new block to the chain. If present, it will find the relevant child and update the block's attribute.
-    def add(self, block):
-        for unit in self.blocks:
-            if block.hash == self.blocks[unit].parent:
-                block.child = self.blocks[unit].hash
-        self.blocks[block.hash] = block
-
-    # Removes the block from the chain.
-    def remove(self, block):
-        del self.blocks[block.hash]
-
-    # Returns a set of endpoints. NOT a dict.
-    def endpoints(self):
-        endpoints = set()
-        for block in self.blocks:
-            if self.blocks[block].child is None:
-                endpoints.add(self.blocks[block])
-        return endpoints
-
-    # Returns the highest block in the chain.
-    def canonical(self):
-        longest = 0
-        longest_timestamp = 0
-        canonical = ''
-        for block in self.blocks:
-            if int(self.blocks[block].height) > longest:
-                longest = int(self.blocks[block].height)
-                longest_timestamp = int(self.blocks[block].timestamp)
-                canonical = self.blocks[block]
-            else:  # Tiebreaker
-                if int(self.blocks[block].height) == longest:
-                    if int(self.blocks[block].timestamp) > longest_timestamp:
-                        longest = int(self.blocks[block].height)
-                        longest_timestamp = int(self.blocks[block].timestamp)
-                        canonical = self.blocks[block]
-        return canonical
-
-    # Returns a boolean indicating whether or not a given block hash is present within the blockchain.
-    def has(self, blockhash):
-        if blockhash in self.blocks:
-            return True
-        else:
-            return False
-
-    # Returns a Block object from the blockchain corresponding to the given hash, and None if it is not present.
-    def get(self, blockhash):
-        if blockhash in self.blocks:
-            return self.blocks[blockhash]
-        else:
-            return None
-
-    # Checks for absent blocks or children and fixes them; this will also update a given master file, if provided.
-    # This does NOT implicitly save the changes to file - it's recommended to call save() after using this function.
-    # Just don't call this unless you really need to.
-    def validate(self, master=None, verbose=True):
-        # Counters for report
-        missingblocks = 0
-        missingchildren = 0
-        report = "No errors detected in blockchain."
-
-        # Check for missing blocks
-        total = len(self.blocks)
-        for i, block in enumerate(list(self.blocks)):
-            if self.get(self.blocks[block].parent) is None:
-                # Get block data from MinaExplorer, then add it to the blockchain
-                response = requests.get(f"https://api.minaexplorer.com/blocks/{self.blocks[block].parent}").json()
-                try:
-                    # Store block to master, if provided
-                    if master:
-                        # Isolate the information we want
-                        timestamp = response["block"]["protocolState"]["blockchainState"]["date"]
-                        previous_state_hash = response["block"]["protocolState"]["previousStateHash"]
-                        creator = response["block"]["creator"]
-                        height = response["block"]["blockHeight"]
-                        if response["block"]["transactions"]["coinbase"] == 720000000000:
-                            charged = False
-                        else:
-                            charged = True
-                        # Add relevant information
-                        new_block = dict()
-                        new_block["protocol_state"]["body"] = {}
-                        new_block["protocol_state"]["body"]["consensus_state"] = {}
-                        new_block["scheduled_time"] = timestamp
-                        new_block["protocol_state"]["previous_state_hash"] = previous_state_hash
-                        new_block["protocol_state"]["body"]["consensus_state"]["block_creator"] = creator
-                        new_block["protocol_state"]["body"]["consensus_state"]["global_slot_since_genesis"] = height
-                        new_block["protocol_state"]["body"]["consensus_state"]["supercharge_coinbase"] = charged
-                        master[self.blocks[block].parent] = new_block
-                    # Create a new block from the data and add it to the blockchain.
-                    response_hash = self.blocks[block].parent
-                    response_parent = response["block"]["protocolState"]["previousStateHash"]
-                    response_height = response["block"]["blockHeight"]
-                    response_timestamp = response["block"]["protocolState"]["blockchainState"]["date"]
-                    block = Block(response_hash, response_parent, response_height, response_timestamp)
-                    self.add(block)
-                    missingblocks += 1
-                # If MinaExplorer doesn't have the block, we'll get a KeyError. Should only happen at the genesis block.
-                except KeyError:
-                    # print(KeyError)  # Debug
-                    continue
-            if verbose:
-                progress(i + 1, total, prefix='Checking for Missing Blocks:', suffix='Complete', length=50)
-        if missingblocks:
-            report = f"Fixed {missingblocks} missing Blocks"
-
-        # Check for missing children.
-        total = len(self.blocks)
-        for j, block in enumerate(list(self.blocks)):
-            if self.get(self.blocks[block].child) is None:
-                for potentialchild in self.blocks:
-                    if self.blocks[potentialchild].parent == self.blocks[block].hash:
-                        self.blocks[block].child = potentialchild
-                        missingchildren += 1
-            if verbose:
-                progress(j + 1, total, prefix='Checking for Missing Children:', suffix='Complete', length=50)
-        if missingchildren:
-            if missingblocks:
-                report += f" and {missingchildren} missing Children"
-            else:
-                report = f"Fixed {missingblocks} missing Children"
-        return report
-
-    # Pickles the object to a destination of user's choice.
-    def save(self, destination):
-        pickle.dump(self, open(destination, "wb"))
-
-
-# Each of the functions below can be called independently, but some rely on data from each other to function properly.
-# For normal usage, just run the 'powercycle()' function, and it'll take care of the sequencing for you.
-# Feel free to call these out of order for specific/specialized tasks, but don't yell at me if something breaks :)
-
-# Synchronize local block collection with Google Cloud bucket, then return the synchronized file listing.
-def download():
-    Path(os.environ.get('OUTPUT_DIR', "mina_mainnet_blocks")).mkdir(parents=True, exist_ok=True)
-    command = f"gsutil -m rsync -r gs://{os.environ.get('BUCKET_NAME', 'mina_mainnet_blocks')} " \
-              f"{os.environ.get('OUTPUT_DIR', 'mina_mainnet_blocks')}"
-    print(f"Running command: {command}")
-    subprocess.run(command.split(), stdout=subprocess.PIPE, shell=True, text=True)
-    return glob(os.environ.get('OUTPUT_DIR', "mina_mainnet_blocks") + "/*")
-
-
-# Prune unnecessary data from blocks and organize them into a collection, then return said collection of blocks.
-# Requires a file listing to iterate through; one can be created with the download() function.
-def parse(block_file_list):
-    master = os.path.abspath(os.environ.get("MASTER", "master.json"))
-    if not Path(master).is_file():
-        with open(master, "w", encoding="ISO-8859-1") as new_master:
-            new_master.write("{}")
-            new_master.close()
-
-    # Parsing involves stripping out all info that we do not need from the block, then storing it back in the master.
-    with open(master, "r+", encoding="ISO-8859-1") as master_file:
-        contents = master_file.read()
-        master_json = json.loads(contents)
-        new_files = 0  # This is just to track how many new blocks were parsed in a given run
-        for file in block_file_list:
-            state_hash = file.split("-")[1].split(".")[0]
-            if state_hash in master_json:
-                continue
-            with open(file, "r", encoding="ISO-8859-1") as json_file:
-                # This will read in each file, deleting the information we don't need from it in the process
-                contents = json_file.read()
-                block = json.loads(contents)
-                # Extract and temporarily store info
-                timestamp = block["scheduled_time"]
-                previous_state_hash = block["protocol_state"]["previous_state_hash"]
-                creator = block["protocol_state"]["body"]["consensus_state"]["block_creator"]
-                height = block["protocol_state"]["body"]["consensus_state"]["global_slot_since_genesis"]
-                charged = block["protocol_state"]["body"]["consensus_state"]["supercharge_coinbase"]
-                # Strip all info
-                block.clear()
-                # Re-add information and store to our 'parsed' dict
-                block["protocol_state"] = {}
-                block["protocol_state"]["body"] = {}
-                block["protocol_state"]["body"]["consensus_state"] = {}
-                block["scheduled_time"] = timestamp
-                block["protocol_state"]["previous_state_hash"] = previous_state_hash
-                block["protocol_state"]["body"]["consensus_state"]["block_creator"] = creator
-                block["protocol_state"]["body"]["consensus_state"]["global_slot_since_genesis"] = height
-                block["protocol_state"]["body"]["consensus_state"]["supercharge_coinbase"] = charged
-                master_json[state_hash] = block
-                new_files += 1
-        master_file.seek(0)
-        master_file.truncate()
-        json.dump(master_json, master_file, ensure_ascii=False, indent=4)
-    return master_json, new_files
-
-
-# In the spirit of making incremental updates as fast as possible, the blockchain will be serialized, like the master.
-def blockmap(master):
-    mapping = os.environ.get("BLOCKCHAIN", "mapping.pickle")
-    # Load our past mapping to pick up where we left off
-    try:
-        blockchain = pickle.load(open(mapping, "rb"))
-    except (OSError, IOError):
-        blockchain = Blockchain()
-
-    for item in master:
-        # Skip previously mapped blocks from being re-mapped
-        if blockchain.has(item):
-            continue
-        item_hash = item
-        parent = master[item]["protocol_state"]["previous_state_hash"]
-        height = master[item]["protocol_state"]["body"]["consensus_state"]["global_slot_since_genesis"]
-        timestamp = master[item]["scheduled_time"]
-        block = Block(item_hash, parent, height, timestamp)
-        blockchain.add(block)
-    pickle.dump(blockchain, open(mapping, "wb"))
-    return blockchain
-
-
-# This will validate the blockchain, update both the blockchain and master with any corrections, and save both to file.
-def validate(blockchain, master, verbose):
-    report = blockchain.validate(master, verbose)
-    blockchain_file = os.environ.get("BLOCKCHAIN", "mapping.pickle")
-    master_file = os.path.abspath(os.environ.get("MASTER", "master.json"))
-    blockchain.save(blockchain_file)
-    with open(master_file, "w", encoding="ISO-8859-1") as new_master:
-        new_master.seek(0)
-        new_master.truncate()
-        json.dump(master, new_master, ensure_ascii=False, indent=4)
-    return report
-
-
-# Marks the canonical chain as such.
-def paint(blockchain):
-    canonical = blockchain.canonical()
-    while canonical is not None:
-        canonical.canon = True
-        canonical = blockchain.get(canonical.parent)
-
-
-# Creates a set of forks from the blockchain and returns it
-def process(blockchain, master):
-    forks = []
-    endpoints = blockchain.endpoints()
-
-    for head in endpoints:
-        if head.canon:  # The canonical head is technically an endpoint, so skip it
-            continue
-        container = {}
-        while not head.canon:
-            container[head.hash] = master[head.hash]
-            head = blockchain.get(head.parent)
-        forks.append(container)
-    return forks
-
-
-# This will unpack our stored staged forks (if available), so that we only do work on new or updated forks
-# Makes use of many serialized data "chunks" - they may seem redundant or wasteful, but they speed things up massively
-# TODO: Bundle the various pickles into a single one so there's less I/O and visual clutter
-def prestage(forks, blocks, blockchain):
-    # Staging file is used to store previously staged forks
-    staging = os.environ.get("STAGING", "staging.json")
-    # Latest file is used to store the most recently processed blocks within all known forks
-    late = os.environ.get("LATEST", "latest.pickle")
-    # Resolved file is used to store a mapping of timestamps to hashes for the blockchain's canonical chain
-    resolution = os.environ.get("RESOLVED", "resolved.pickle")
-    # Alertable file is used to store a mapping of blockchain height to hashes for the entire blockchain
-    alert = os.environ.get("ALERTABLE", "alertable.pickle")
-
-    # Opening Staging
-    if not Path(staging).is_file():
-        with open(staging, "w", encoding="ISO-8859-1") as new_staging:
-            new_staging.write("{}")
-            new_staging.close()
-    # Opening Latest
-    try:
-        latest = pickle.load(open(late, "rb"))
-    except (OSError, IOError):
-        latest = set()
-    # Opening Resolved
-    try:
-        resolved = pickle.load(open(resolution, "rb"))
-    except (OSError, IOError):
-        resolved = [set(), {}]
-    # Opening Alertable
-    try:
-        alertable = pickle.load(open(alert, "rb"))
-    except (OSError, IOError):
-        alertable = [list(), []]
-
-    # Update Resolved and Alertable first, as they rely only on the main blockchain data
-    for block_hash in blockchain.blocks:
-        block = blockchain.get(block_hash)
-        # Alertable
-        # Alertable is an array containing a list and an array. The list is used to find the intersection of blockchain
-        # heights. Its index is mapped 1:1 to the array, which contains the corresponding hash of the block in question
-        if block.hash not in alertable[1]:
-            alertable[0].append(block.height)
-            alertable[1].append(block.hash)
-
-        # Resolved
-        # Resolved is an array containing a set and a dict. The set is used to find the appropriate timestamp of
-        # resolution, while the dict maps that resolution timestamp to a hash used for lookup to get the final block
-        if block.canon and block.timestamp not in resolved[0]:
-            resolved[0].add(int(block.timestamp))  # Timestamps are unique, though only by coincidence, not definition
-            resolved[1][int(block.timestamp)] = block.hash
-
-    # Load our past staging to pick up where we left off
-    with open(staging, "r+", encoding="ISO-8859-1") as staging_file:
-        contents = staging_file.read()
-        staged = json.loads(contents)
-
-        # Update latest as necessary
-        for block in staged:
-            latest.add(staged[block]["latest"])
-
-        # Check head of fork to "latest" field in staged forks - if they match, the staged fork is up to date
-        for fork in forks:
-            updated = False
-            if list(fork.keys())[0] in latest:
-                updated = True
-            # Go ahead with staging if the fork is not up to date within the staging json
-            if not updated:
-                stage(staged, fork, blocks, resolved, alertable)
-
-        staging_file.seek(0)
-        staging_file.truncate()
-
-        # Re-serialization
-        json.dump(staged, staging_file, ensure_ascii=False, indent=4)
-        pickle.dump(latest, open(late, "wb"))
-        pickle.dump(resolved, open(resolution, "wb"))
-        pickle.dump(alertable, open(alert, "wb"))
-    return staged
-
-
-# Prepares the fork data to be received properly by the FireBase database.
-def stage(staging, fork, blocks, resolved, alert):
-    # 'staged_fork' contains all data for a given fork
-    staged_fork = {"length": len(fork), "blocks": {"block": [], "timestamp": [], "creator": [], "alertable": []},
-                   "rewards": 0, "latest": '', "last_updated": 0, "resolved_at": ''}
-    initialized = False
-    fork_root = ""
-    for block in fork:
-        # Blocks in fork inserted such that oldest block is at index 0
-        staged_fork["blocks"]["block"].insert(0, block)
-        staged_fork["blocks"]["timestamp"].insert(0, int(fork[block]["scheduled_time"]))
-        staged_fork["blocks"]["creator"].insert(0, fork[block]["protocol_state"]["body"]["consensus_state"][
-            "block_creator"])
-        # Set local variable to the oldest block hash for use later in creating unique ID hash
-        if not initialized:
-            fork_root = block
-            initialized = True
-        # Add 1440 mina to "lost rewards" if the block is supercharged, otherwise 720
-        if fork[block]["protocol_state"]["body"]["consensus_state"]["supercharge_coinbase"]:
-            staged_fork["rewards"] += 1440
-        else:
-            staged_fork["rewards"] += 720
-        # Update the 'latest' and 'last_updated' fields according to our most recent block
-        if int(fork[block]["scheduled_time"]) > int(staged_fork["last_updated"]):
-            staged_fork["last_updated"] = int(fork[block]["scheduled_time"])
-            staged_fork["latest"] = [block][0]
-
-        # Resolved At check - checks for the earliest canonical block after the current end of the fork
-        resolved_at = min(filter(lambda i: i > int(blocks[fork_root]["scheduled_time"]), resolved[0]))
-        resolved_block = resolved[1][resolved_at]
-        staged_fork["resolved_at"] = resolved_block
-
-        # Alertable check - checks for any blocks in the blockchain produced at the same slot as this current one
-        # Sometimes there are none, and there never seem to be more than one, so only one hash is stored here
-        alertable = ''
-        comparison = set()
-        comparison.add(fork[block]["protocol_state"]["body"]["consensus_state"]["global_slot_since_genesis"])
-        intersection = comparison.intersection(set(alert[0]))
-        for intersect in intersection:
-            result = alert[1][alert[0].index(intersect)]
-            if result != block:
-                alertable = result
-
-        staged_fork["blocks"]["alertable"].insert(0, alertable)
-
-    # Unique ID is MD5 generated from the timestamp of the first block in the fork combined with its state hash
-    if fork_root != '':
-        fork_combo = fork_root + blocks[fork_root]["scheduled_time"] + \
-                     blocks[fork_root]["protocol_state"]["body"]["consensus_state"]["block_creator"]
-        fork_hash = hashlib.md5(fork_combo.encode("utf-8")).hexdigest()
-        staging[fork_hash] = staged_fork
-
-
-# Pushes changes to a FireBase database.
-# Requires valid data to be contained within its input parameters - this can be obtained using the stage() function.
-def firebase_update(staging):
-    # Set up firebase environment
-    environment = os.environ.get("ENV", "DEV")
-    url = os.environ.get("DB_URL", "https://sv-mina-forks-default-rtdb.firebaseio.com/")
-    int(os.environ.get("PORT", 8080))
-
-    if environment == "DEV":
-        cred = credentials.Certificate('service_account.json')
-        initialize_app(cred, options={'databaseURL': url})
-    else:
-        initialize_app(options={'databaseURL': url})
-    firestore.client()
-
-    # Overwrite the entire 'forks' database section with data
-    db_json = db.reference("forks")
-    db_json.set(staging)
-
-
-# Reset everything and run from the top, optionally with printouts based on boolean parameter.
-def powercycle(printout=False, integrity_check=False):
-    # Download Blocks
-    start = time.time()
-    files = download()
-    end = time.time()
-    if printout:
-        print(f"{len(files)} Blocks Synchronized in {end - start} seconds")
-
-    # Parse Blocks
-    start = time.time()
-    master, new_files = parse(files)
-    end = time.time()
-    if printout:
-        print(f"Parsed {new_files} new Blocks in {end - start} seconds.")
-
-    # Map Blocks
-    start = time.time()
-    blockchain = blockmap(master)
-    end = time.time()
-    if printout:
-        print(f"Mapped all Blocks in {end - start} seconds.")
-
-    # Validate the blockchain to fix any potential errors before we do work
-    # This takes a long time, so you should only do it if you think there's a problem.
-    if integrity_check:
-        start = time.time()
-        report = validate(blockchain, master, printout)
-        end = time.time()
-        if printout:
-            print(f"Verified Blockchain integrity in {end - start} seconds.")
-            print(report)
-
-    # Determine canonical status of entire blockchain information
-    start = time.time()
-    paint(blockchain)
-    end = time.time()
-    if printout:
-        print(f"Painted canonical chain in {end - start} seconds.")
-
-    # Sort forked blocks into arrays of unique forks
-    start = time.time()
-    forks = process(blockchain, master)
-    end = time.time()
-    if printout:
-        print(f"Processed {len(forks)} Forks in {end - start} seconds.")
-
-    # Place forks into JSON data for upload
-    start = time.time()
-    staging = prestage(forks, master, blockchain)
-    end = time.time()
-    if printout:
-        print(f"Staged {len(staging)} forks for upload in {end - start} seconds.")
-
-    # # Upload to firebase database
-    start = time.time()
-    firebase_update(staging)
-    end = time.time()
-    if printout:
-        print(f"Uploaded {len(staging)} total forks with the FireBase database in {end - start} seconds.")
-
-
-if __name__ == '__main__':
-    powercycle(printout=True, integrity_check=False)
+# Imports
+from array import array
+from backends import FirebaseBackend
+from bisect import bisect_left, bisect_right
+from collections import deque
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+import contextvars
+from explorer import Explorer
+from functools import partial
+import hashlib
+from itertools import islice
+import json
+import metrics
+import mmap
+import os
+from pathlib import Path
+import pickle
+import re
+import shutil
+from store import Archive, BlockStore, Manifest, Snapshot
+import struct
+import subprocess
+import tempfile
+import zlib
+
+
+# Progress bar. Just for visual fluff, can probably be removed.
+def progress(iteration, total, prefix='', suffix='', decimals=1, length=100, fill='█', end="\r"):
+    percent = ("{0:." + str(decimals) + "f}").format(100 * (iteration / float(total)))
+    filled = int(length * iteration // total)
+    bar = fill * filled + '-' * (length - filled)
+    print(f'\r{prefix} |{bar}| {percent}% {suffix}', end=end)
+    if iteration == total:
+        print()
+
+
+# Because I as of yet have not found a sufficient python library for this task, we're making our own classes.
+# A Block is what gets handed to Blockchain.add(); the chain doesn't keep it, only its fields (see Blockchain below).
+class Block:
+    __slots__ = ("hash", "parent", "height", "timestamp", "canon")
+
+    def __init__(self, h='', p='', d=0, t=''):
+        self.hash = h
+        self.parent = p
+        self.height = d
+        self.timestamp = t
+        self.canon = False
+
+    # Blocks pickled before __slots__ carry a plain dict (plus the long gone 'child' attribute), so take what we know.
+    def __setstate__(self, state):
+        if isinstance(state, tuple):
+            state = {**(state[0] or {}), **state[1]}
+        for name, default in zip(Block.__slots__, ('', '', 0, '', False)):
+            setattr(self, name, state.get(name, default))
+
+
+# A block as it is stored within a Blockchain: a (chain, id) pair whose attributes read from and write to the chain's
+# columns, with the same names as a Block's. Views are created on demand and compare equal if they refer to the same
+# block, so they can't be told apart from the blocks the chain used to hold, other than by identity.
+class BlockView:
+    __slots__ = ("chain", "id")
+
+    def __init__(self, chain, i):
+        self.chain = chain
+        self.id = i
+
+    @property
+    def hash(self):
+        return self.chain.hashes[self.id]
+
+    @property
+    def parent(self):
+        return self.chain.hashes[self.chain.parents[self.id]]
+
+    @property
+    def height(self):
+        return self.chain.heights[self.id]
+
+    @property
+    def timestamp(self):
+        return self.chain.timestamps[self.id]
+
+    @property
+    def canon(self):
+        return bool(self.chain.canons[self.id])
+
+    @canon.setter
+    def canon(self, value):
+        self.chain.canons[self.id] = bool(value)
+
+    def __eq__(self, other):
+        if not isinstance(other, BlockView):
+            return NotImplemented
+        return self.chain is other.chain and self.id == other.id
+
+    def __hash__(self):
+        return self.id
+
+
+# Read-only mapping of hash to BlockView over the blocks present in a Blockchain, standing in for its old dict.
+class BlockMap(Mapping):
+    def __init__(self, chain):
+        self.chain = chain
+
+    def __getitem__(self, blockhash):
+        block = self.chain.get(blockhash)
+        if block is None:
+            raise KeyError(blockhash)
+        return block
+
+    def __contains__(self, blockhash):
+        return self.chain.has(blockhash)
+
+    def __iter__(self):
+        hashes, present = self.chain.hashes, self.chain.present
+        return (hashes[i] for i in range(len(hashes)) if present[i])
+
+    def __len__(self):
+        return self.chain.count
+
+
+# Sorted index of canonical block timestamps, used to look up the first canonical block after a given moment.
+# Timestamps are unique, though only by coincidence, not definition - so removal checks the hash before letting go.
+# Blocks almost always arrive in timestamp order, which makes the insertions appends in practice.
+# The timestamps and their hashes are kept as two parallel sequences. In an index loaded from a chain file they are
+# read-only views of the file, which are copied into lists the first time the index changes.
+class TimestampIndex:
+    def __init__(self, timestamps=None, hashes=None):
+        self.timestamps = [] if timestamps is None else timestamps
+        self.hashes = [] if hashes is None else hashes
+
+    # Older pickles keep the hashes in a dict keyed by timestamp.
+    def __setstate__(self, state):
+        if isinstance(state["hashes"], dict):
+            state["hashes"] = [state["hashes"][timestamp] for timestamp in state["timestamps"]]
+        self.__dict__.update(state)
+
+    def __getstate__(self):
+        self.thaw()
+        return self.__dict__
+
+    def thaw(self):
+        if not isinstance(self.timestamps, list):
+            self.timestamps = list(self.timestamps)
+            self.hashes = list(self.hashes)
+
+    def add(self, timestamp, blockhash):
+        self.thaw()
+        position = bisect_left(self.timestamps, timestamp)
+        if position < len(self.timestamps) and self.timestamps[position] == timestamp:
+            self.hashes[position] = blockhash
+        else:
+            self.timestamps.insert(position, timestamp)
+            self.hashes.insert(position, blockhash)
+
+    def discard(self, timestamp, blockhash):
+        position = bisect_left(self.timestamps, timestamp)
+        if position < len(self.timestamps) and self.timestamps[position] == timestamp and \
+                self.hashes[position] == blockhash:
+            self.thaw()
+            del self.timestamps[position]
+            del self.hashes[position]
+
+    # Returns the hash of the earliest block strictly after the given timestamp, or None if there isn't one.
+    def successor(self, timestamp):
+        position = bisect_right(self.timestamps, timestamp)
+        if position == len(self.timestamps):
+            return None
+        return self.hashes[position]
+
+    def __len__(self):
+        return len(self.timestamps)
+
+
+# Read-only sequence of the strings in a chain file, decoded as they are asked for. If given a sequence of ids, it
+# stands for the strings at those ids instead.
+class MappedStrings:
+    def __init__(self, offsets, blob, ids=None):
+        self.offsets = offsets
+        self.blob = blob
+        self.ids = ids
+
+    def __getitem__(self, i):
+        if self.ids is not None:
+            i = self.ids[i]
+        return str(self.blob[self.offsets[i]:self.offsets[i + 1]], "utf-8")
+
+    def __len__(self):
+        return len(self.ids) if self.ids is not None else len(self.offsets) - 1
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+# Read-only hash -> id lookup over a chain file's open addressing table, standing in for the ids dict.
+class MappedIds:
+    def __init__(self, table, hashes):
+        self.table = table
+        self.hashes = hashes
+
+    def get(self, blockhash, default=None):
+        if not isinstance(blockhash, str):
+            return default
+        mask = len(self.table) - 1
+        slot = zlib.crc32(blockhash.encode("utf-8")) & mask
+        while self.table[slot] != -1:
+            if self.hashes[self.table[slot]] == blockhash:
+                return self.table[slot]
+            slot = (slot + 1) & mask
+        return default
+
+    def __len__(self):
+        return len(self.hashes)
+
+
+# Chain files start with a fixed header: the magic, the number of ids, present blocks, slots, lookup table entries,
+# resolved timestamps, tips, orphans and archived parents, then the cursor, the tip's id and rank, the painted tip's id,
+# the length of the hash blob and the slot that slot_first starts at. See Blockchain.dump() for the sections that
+# follow.
+# Files from before the slot index had a base (LEGACY_CHAIN_MAGIC) have a header without it, and start at slot 0.
+CHAIN_MAGIC = b"MINACHN2"
+CHAIN_HEADER = struct.Struct("<8s15q")
+LEGACY_CHAIN_MAGIC = b"MINACHN1"
+LEGACY_CHAIN_HEADER = struct.Struct("<8s14q")
+CHAIN_COLUMNS = ("parents", "heights", "timestamps", "first", "sibling", "slot_next")
+
+
+# Basic structure that holds the blocks of a chain, and is able to perform work on them using the attributes as defined
+# in the Block class. To keep millions of blocks small, the chain is stored by column rather than as Block objects:
+# every state hash seen (parents that aren't present yet included) is interned to an integer id, and the height,
+# timestamp, parent id and canon flag of a block are kept at that id in typed arrays. The hashes themselves are only
+# ever stored once. get(), endpoints() and canonical() hand out BlockViews over the columns, and 'blocks' is a read-only
+# mapping of hash to BlockView for anything that wants to look at the chain as a dict.
+# Alongside the columns, a few indexes (of ids) are maintained on every add() so that nothing has to rescan the chain:
+#   first, sibling     - the children of each id, as a linked list: first[parent] is the latest child to arrive (or -1),
+#                        and sibling[child] the next one along. Kept whether or not the parent is present yet.
+#   slot_first, slot_next - every block produced in each slot (the block height), linked the same way. Slots are dense,
+#                        so slot_first is indexed by the slot itself, less slot_base: the lowest slot in the chain when
+#                        it was last rebuilt, which keeps slot_first as long as the chain's span of slots, not its age.
+#   tips     - set of ids of blocks that have no children (the endpoints)
+#   orphans  - set of ids of blocks whose parent is not (yet) present in the chain
+#   tip      - hash of the highest block, by height with timestamp as the tiebreaker, along with its integer rank
+# The 'painted' attribute is not an index; it records which tip the canon flags currently describe, see paint().
+# Likewise 'resolved' is a TimestampIndex over the canonical chain that is kept up to date by paint(), and 'archived'
+# holds the hashes of blocks that were finalized out of the chain but are still the parents of blocks within it.
+class Blockchain:
+    def __init__(self):
+        self.ids = {}
+        self.hashes = []
+        self.parents = array("q")
+        self.heights = array("q")
+        self.timestamps = array("q")
+        self.canons = bytearray()
+        self.present = bytearray()
+        self.count = 0
+        self.first = array("q")
+        self.sibling = array("q")
+        self.slot_first = array("q")
+        self.slot_next = array("q")
+        self.slot_base = 0
+        self.tips = set()
+        self.orphans = set()
+        self.tip = None
+        self.tip_rank = (0, 0)
+        self.painted = None
+        self.resolved = TimestampIndex()
+        self.archived = set()
+        self.cursor = 0
+        self.blocks = BlockMap(self)
+        self.mapped = None
+
+    # The block mapping is only a view over the columns, so it's left out of pickles and recreated on load.
+    def __getstate__(self):
+        self.thaw()
+        state = self.__dict__.copy()
+        del state["blocks"]
+        return state
+
+    # Pickles from before the columnar layout hold a dict of Block objects instead, which are simply added again.
+    def __setstate__(self, state):
+        if "ids" in state:
+            self.__dict__.update(state)
+            self.__dict__.setdefault("archived", set())
+            self.__dict__.setdefault("slot_base", 0)
+            self.blocks = BlockMap(self)
+            self.mapped = None
+            return
+        self.__init__()
+        for block in state["blocks"].values():
+            self.add(block)
+        self.cursor = state.get("cursor", 0)
+        # Without the canonical timestamp index, the next paint() has to be a full one to build it
+        if "resolved" in state:
+            self.resolved = state["resolved"]
+            self.painted = state.get("painted")
+
+    # Rebuilds every index from the columns, for the blocks that are present. Blocks are added back a slot at a time,
+    # each slot's in the order they arrived, so rivals() keeps its order. Only the slots of present blocks are visited,
+    # so this takes as long as the chain is big, however far its slots have got.
+    def reindex(self):
+        blocks = []
+        for slot in sorted({self.heights[i] for i in range(len(self.hashes)) if self.present[i]}):
+            i = self.slot_first[slot - self.slot_base]
+            arrived = []
+            while i != -1:
+                if self.present[i]:
+                    arrived.append(self.copy(BlockView(self, i)))
+                i = self.slot_next[i]
+            blocks.extend(reversed(arrived))
+        painted, resolved, archived, cursor = self.painted, self.resolved, self.archived, self.cursor
+        self.__init__()
+        for block in blocks:
+            self.add(block)
+        self.painted, self.resolved, self.archived, self.cursor = painted, resolved, archived, cursor
+
+    # Returns a standalone Block with the same fields as the given one (a view, usually).
+    @staticmethod
+    def copy(block):
+        duplicate = Block(block.hash, block.parent, block.height, block.timestamp)
+        duplicate.canon = block.canon
+        return duplicate
+
+    # Writes the chain to a chain file, which load() can map back in without deserializing anything. After the header
+    # (see CHAIN_HEADER) come fixed-width sections of 64 bit integers: each of the CHAIN_COLUMNS, indexed by id, then
+    # slot_first, the offsets of each id's hash within the hash blob, the hash -> id lookup table (open addressing on
+    # the CRC-32 of the hash, with linear probing and -1 for empty slots), the resolved index's timestamps and the ids
+    # they belong to, and the ids of the tips, orphans and archived parents. Last are the canon and present flags, a
+    # byte per id, and the hash blob itself.
+    def dump(self, path):
+        encoded = [blockhash.encode("utf-8") for blockhash in self.hashes]
+        offsets = array("q", [0])
+        total = 0
+        for blockhash in encoded:
+            total += len(blockhash)
+            offsets.append(total)
+        size = 8
+        while size < 2 * len(encoded):
+            size *= 2
+        table = array("q", [-1]) * size
+        for i, blockhash in enumerate(encoded):
+            slot = zlib.crc32(blockhash) & (size - 1)
+            while table[slot] != -1:
+                slot = (slot + 1) & (size - 1)
+            table[slot] = i
+        resolved = [(timestamp, self.ids.get(blockhash)) for timestamp, blockhash in
+                    zip(self.resolved.timestamps, self.resolved.hashes) if self.ids.get(blockhash) is not None]
+        tips = array("q", sorted(self.tips))
+        orphans = array("q", sorted(self.orphans))
+        archived = array("q", sorted(i for i in map(self.ids.get, self.archived) if i is not None))
+
+        with open(path, "wb") as chain_file:
+            chain_file.write(CHAIN_HEADER.pack(CHAIN_MAGIC, len(encoded), self.count, len(self.slot_first), size,
+                                               len(resolved), len(tips), len(orphans), len(archived), self.cursor,
+                                               self.ids.get(self.tip, -1), self.tip_rank[0], self.tip_rank[1],
+                                               self.ids.get(self.painted, -1), total, self.slot_base))
+            # The columns may still be views of a mapped file, so they're written as plain buffers
+            for name in CHAIN_COLUMNS + ("slot_first",):
+                chain_file.write(getattr(self, name))
+            for section in (offsets, table, array("q", (timestamp for timestamp, i in resolved)),
+                            array("q", (i for timestamp, i in resolved)), tips, orphans, archived):
+                chain_file.write(section)
+            chain_file.write(self.canons)
+            chain_file.write(self.present)
+            chain_file.write(b"".join(encoded))
+
+    # Maps a chain file written by dump() straight into a Blockchain. Nothing is deserialized: the columns, hashes and
+    # resolved index are read from the file as they are used, and the file's pages are shared with any other process
+    # mapping the same file. Canon flags can be changed in place (the mapping is copy on write, so the file itself
+    # never changes), but anything else that modifies the chain copies it into memory first, see thaw().
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as chain_file:
+            mapped = mmap.mmap(chain_file.fileno(), 0, access=mmap.ACCESS_COPY)
+        header = CHAIN_HEADER if mapped[:len(CHAIN_MAGIC)] == CHAIN_MAGIC else LEGACY_CHAIN_HEADER
+        magic, size, count, slots, table, resolved, tips, orphans, archived, cursor, tip, height, timestamp, painted, \
+            total, *base = header.unpack_from(mapped)
+        if magic not in (CHAIN_MAGIC, LEGACY_CHAIN_MAGIC):
+            raise ValueError(f"{path} is not a chain file")
+        view = memoryview(mapped)
+        position = header.size
+
+        def section(length, width=8):
+            nonlocal position
+            part = view[position:position + length * width]
+            position += length * width
+            return part.cast("q") if width == 8 else part
+
+        chain = cls.__new__(cls)
+        for name in CHAIN_COLUMNS:
+            setattr(chain, name, section(size))
+        chain.slot_first = section(slots)
+        chain.slot_base = base[0] if base else 0
+        offsets = section(size + 1)
+        lookup = section(table)
+        resolved_timestamps = section(resolved)
+        resolved_ids = section(resolved)
+        chain.tips = set(section(tips))
+        chain.orphans = set(section(orphans))
+        archived = section(archived)
+        chain.canons = section(size, 1)
+        chain.present = section(size, 1)
+        chain.hashes = MappedStrings(offsets, section(total, 1))
+        chain.ids = MappedIds(lookup, chain.hashes)
+        chain.resolved = TimestampIndex(resolved_timestamps, MappedStrings(offsets, chain.hashes.blob, resolved_ids))
+        chain.archived = {chain.hashes[i] for i in archived}
+        chain.count = count
+        chain.cursor = cursor
+        chain.tip = chain.hashes[tip] if tip != -1 else None
+        chain.tip_rank = (height, timestamp)
+        chain.painted = chain.hashes[painted] if painted != -1 else None
+        chain.blocks = BlockMap(chain)
+        chain.mapped = mapped
+        return chain
+
+    # Copies a chain mapped in by load() into memory, so it can be changed like any other. Does nothing otherwise.
+    def thaw(self):
+        if self.mapped is None:
+            return
+        self.hashes = list(self.hashes)
+        self.ids = {blockhash: i for i, blockhash in enumerate(self.hashes)}
+        for name in CHAIN_COLUMNS + ("slot_first",):
+            column = array("q")
+            column.frombytes(getattr(self, name).cast("B"))
+            setattr(self, name, column)
+        self.canons = bytearray(self.canons)
+        self.present = bytearray(self.present)
+        self.resolved.thaw()
+        self.mapped = None
+
+    # Returns the id of the given hash, interning it first if it hasn't been seen before.
+    def intern(self, blockhash):
+        i = self.ids.get(blockhash)
+        if i is None:
+            i = len(self.hashes)
+            self.ids[blockhash] = i
+            self.hashes.append(blockhash)
+            self.parents.append(-1)
+            self.heights.append(0)
+            self.timestamps.append(0)
+            self.canons.append(0)
+            self.present.append(0)
+            self.first.append(-1)
+            self.sibling.append(-1)
+            self.slot_next.append(-1)
+        return i
+
+    # Yields the ids of every known child of the given id.
+    def offspring(self, i):
+        child = self.first[i]
+        while child != -1:
+            yield child
+            child = self.sibling[child]
+
+    # Takes 'i' out of the linked list that starts at heads[index], where links[i] is the next id after i.
+    @staticmethod
+    def unlink(heads, index, links, i):
+        if heads[index] == i:
+            heads[index] = links[i]
+        else:
+            node = heads[index]
+            while links[node] != i:
+                node = links[node]
+            links[node] = links[i]
+        links[i] = -1
+
+    # Adds a new block to the chain, updating the columns and indexes in constant time. Children that arrived before
+    # their parent are already waiting in the children index, so they are simply adopted.
+    def add(self, block):
+        # Read everything off the block first, as it may be a view of the very block that is about to be replaced
+        blockhash, parent_hash, canon = block.hash, block.parent, block.canon
+        height, timestamp = int(block.height), int(block.timestamp)
+        self.thaw()
+        i = self.intern(blockhash)
+        if self.present[i]:
+            self.remove(BlockView(self, i))
+        parent = self.intern(parent_hash)
+        self.parents[i] = parent
+        self.heights[i] = height
+        self.timestamps[i] = timestamp
+        self.canons[i] = bool(canon)
+        self.present[i] = 1
+        self.count += 1
+        self.sibling[i] = self.first[parent]
+        self.first[parent] = i
+        self.tips.discard(parent)
+        if self.first[i] == -1:
+            self.tips.add(i)
+        if not self.present[parent]:
+            self.orphans.add(i)
+        for child in self.offspring(i):
+            self.orphans.discard(child)
+        # The first block sets where the slot index starts; one from before that moves the start back
+        if not self.slot_first:
+            self.slot_base = height
+        elif height < self.slot_base:
+            self.slot_first[0:0] = array("q", [-1]) * (self.slot_base - height)
+            self.slot_base = height
+        slot = height - self.slot_base
+        if slot >= len(self.slot_first):
+            self.slot_first.extend([-1] * (slot + 1 - len(self.slot_first)))
+        self.slot_next[i] = self.slot_first[slot]
+        self.slot_first[slot] = i
+        rank = (height, timestamp)
+        if rank > self.tip_rank:
+            self.tip = blockhash
+            self.tip_rank = rank
+
+    # Removes the block from the chain. Its hash stays interned, so re-adding it later reuses the same id.
+    def remove(self, block):
+        self.thaw()
+        i = self.ids.get(block.hash)
+        if i is None or not self.present[i]:
+            raise KeyError(block.hash)
+        parent = self.parents[i]
+        self.present[i] = 0
+        self.canons[i] = 0
+        self.count -= 1
+        self.unlink(self.first, parent, self.sibling, i)
+        if self.first[parent] == -1 and self.present[parent]:
+            self.tips.add(parent)
+        self.tips.discard(i)
+        self.orphans.discard(i)
+        for child in self.offspring(i):
+            self.orphans.add(child)
+        self.unlink(self.slot_first, self.heights[i] - self.slot_base, self.slot_next, i)
+        # The highest block is always an endpoint, so losing it only requires a look over the (few) remaining tips
+        if block.hash == self.tip:
+            self.tip = None
+            self.tip_rank = (0, 0)
+            for tip in self.tips:
+                rank = (self.heights[tip], self.timestamps[tip])
+                if rank > self.tip_rank:
+                    self.tip = self.hashes[tip]
+                    self.tip_rank = rank
+
+    # Takes everything that can no longer change out of the chain and returns it as a list of Blocks: the canonical
+    # chain below the given height, and every fork that ended below it. Forks still growing past that height keep the
+    # canonical block they branched off from (and everything after it), so they can still be walked back and resolved.
+    # Relies on the canon flags being up to date, so only call it right after paint().
+    def finalize(self, horizon):
+        live = set()
+        floor = horizon
+        for tip in self.tips:
+            if self.canons[tip] or self.heights[tip] < horizon:
+                continue
+            node = tip
+            while self.present[node] and not self.canons[node]:
+                live.add(node)
+                node = self.parents[node]
+            if self.present[node]:
+                floor = min(floor, self.heights[node])
+
+        final = []
+        for i in range(len(self.hashes)):
+            if self.present[i] and i not in live and self.heights[i] < (floor if self.canons[i] else horizon):
+                final.append(self.copy(BlockView(self, i)))
+                self.present[i] = 0
+                if self.canons[i]:
+                    self.resolved.discard(self.timestamps[i], self.hashes[i])
+        if final:
+            # Rebuilding drops the finalized blocks' ids along with them, so the columns stay as small as the chain
+            archived = self.archived | {block.hash for block in final}
+            self.reindex()
+            self.archived = {self.hashes[self.parents[orphan]] for orphan in self.orphans} & archived
+        return final
+
+    # Returns the hashes of every known child of the given block hash.
+    def successors(self, blockhash):
+        i = self.ids.get(blockhash)
+        return set() if i is None else {self.hashes[child] for child in self.offspring(i)}
+
+    # Returns the hashes of every block produced in the same slot as the given one, not including the block itself.
+    # They're listed in the order they arrived in.
+    def rivals(self, blockhash, slot):
+        slot = int(slot)
+        rivals = []
+        slot -= self.slot_base
+        rival = self.slot_first[slot] if 0 <= slot < len(self.slot_first) else -1
+        while rival != -1:
+            if self.hashes[rival] != blockhash:
+                rivals.append(self.hashes[rival])
+            rival = self.slot_next[rival]
+        rivals.reverse()
+        return rivals
+
+    # Returns a set of endpoints. NOT a dict.
+    def endpoints(self):
+        return {BlockView(self, tip) for tip in self.tips}
+
+    # Returns the highest block in the chain, or None if the chain is empty. The tip is tracked by add() and remove().
+    def canonical(self):
+        return self.get(self.tip)
+
+    # Returns a boolean indicating whether or not a given block hash is present within the blockchain.
+    def has(self, blockhash):
+        i = self.ids.get(blockhash)
+        return i is not None and bool(self.present[i])
+
+    # Returns a view of the block corresponding to the given hash, and None if it is not present.
+    def get(self, blockhash):
+        i = self.ids.get(blockhash)
+        if i is None or not self.present[i]:
+            return None
+        return BlockView(self, i)
+
+    # Checks for absent blocks or children and fixes them; this will also update a given master file, if provided.
+    # This does NOT implicitly save the changes to file - it's recommended to call save() after using this function.
+    # Missing blocks are fetched from MinaExplorer through the given Explorer (or a default one), concurrently and with
+    # caching, so this is no longer as painfully slow as it used to be - but still, only call it if you need to.
+    def validate(self, master=None, verbose=True, explorer=None):
+        # Counters for report
+        missingblocks = 0
+        missingchildren = 0
+        report = "No errors detected in blockchain."
+
+        # Check for missing blocks. Only orphans can be missing a parent, so there's no need to look at the rest.
+        # Parents that were finalized out of the chain aren't missing, they're in the archive.
+        missing = sorted({self.hashes[self.parents[orphan]] for orphan in self.orphans} - self.archived)
+        if verbose:
+            print(f"Fetching {len(missing)} missing Blocks from MinaExplorer")
+        if missing:
+            if explorer is None:
+                explorer = Explorer()
+            responses = explorer.blocks(missing)
+        else:
+            responses = {}
+        total = len(missing)
+        for i, response_hash in enumerate(missing):
+            # If MinaExplorer doesn't have the block, there's no response. Should only happen at the genesis block.
+            response = responses.get(response_hash)
+            try:
+                if response is not None:
+                    # Isolate the information we want
+                    timestamp = response["block"]["protocolState"]["blockchainState"]["date"]
+                    previous_state_hash = response["block"]["protocolState"]["previousStateHash"]
+                    height = response["block"]["blockHeight"]
+                    # Store block to master, if provided
+                    if master is not None:
+                        creator = response["block"]["creator"]
+                        if response["block"]["transactions"]["coinbase"] == 720000000000:
+                            charged = False
+                        else:
+                            charged = True
+                        master[response_hash] = prune(timestamp, previous_state_hash, creator, height, charged)
+                    # Create a new block from the data and add it to the blockchain.
+                    self.add(Block(response_hash, previous_state_hash, height, timestamp))
+                    missingblocks += 1
+            # A response without the fields we need is treated the same as no response at all
+            except KeyError:
+                pass
+            if verbose:
+                progress(i + 1, total, prefix='Checking for Missing Blocks:', suffix='Complete', length=50)
+        if missingblocks:
+            report = f"Fixed {missingblocks} missing Blocks"
+
+        # Check for missing children. add() keeps the children index up to date, so this just confirms every block is
+        # registered with its parent and repairs the index entry if it isn't.
+        total = len(self.blocks)
+        for j, block in enumerate(list(self.blocks)):
+            if block not in self.successors(self.blocks[block].parent):
+                self.add(self.blocks[block])
+                missingchildren += 1
+            if verbose:
+                progress(j + 1, total, prefix='Checking for Missing Children:', suffix='Complete', length=50)
+        if missingchildren:
+            if missingblocks:
+                report += f" and {missingchildren} missing Children"
+            else:
+                report = f"Fixed {missingchildren} missing Children"
+        return report
+
+    # Pickles the object to a destination of user's choice.
+    def save(self, destination):
+        pickle.dump(self, open(destination, "wb"))
+
+
+# The notifier is configured through environment variables, read as each stage runs. When one process runs the pipelines
+# of several networks (see networks.py), 'network' holds the one that the current thread is working for: its name, its
+# environment variable prefix (DEVNET_ and so on), its directory and its resident snapshot.
+network = contextvars.ContextVar("network", default=None)
+
+
+# Returns the named setting: the current network's own environment variable if it has one, or else the process's, or
+# else the default.
+def setting(name, default=None):
+    current = network.get()
+    if current is not None and current.prefix + name in os.environ:
+        return os.environ[current.prefix + name]
+    return os.environ.get(name, default)
+
+
+# Returns the named file or directory setting. A network's relative paths are taken from its own directory, so no two
+# networks share a file.
+def location(name, default):
+    value = setting(name, default)
+    current = network.get()
+    if current is None:
+        return value
+    return os.path.join(current.directory, value)
+
+
+# Returns the named FireBase root setting. A network's roots go under its name ("devnet/forks" and so on), unless it
+# has its own.
+def firebase_root(name, default):
+    current = network.get()
+    if current is None or current.prefix + name in os.environ:
+        return setting(name, default)
+    return f"{current.name}/{setting(name, default)}"
+
+
+# When set, a process pool shared by everything running in the process (see networks.py), which parse() and
+# build_segments() hand their work to instead of starting a pool of their own; and an HTTP session shared the same way,
+# which validate() looks up missing blocks through.
+pool = None
+session = None
+
+
+# Calls 'function' on each of 'items' in worker processes, and yields the results in order. At most 'workers' items are
+# with the shared pool at a time, so that one caller's backlog can't crowd everyone else out of it. Without a shared
+# pool, a pool of 'workers' processes is started for the call.
+def pooled(function, items, workers):
+    if pool is None:
+        with ProcessPoolExecutor(max_workers=workers) as own:
+            yield from own.map(function, items)
+        return
+    items = iter(items)
+    running = deque(pool.submit(function, item) for item in islice(items, workers))
+    while running:
+        result = running.popleft().result()
+        running.extend(pool.submit(function, item) for item in islice(items, 1))
+        yield result
+
+
+# Each of the functions below can be called independently, but some rely on data from each other to function properly.
+# For normal usage, just run the 'powercycle()' function, and it'll take care of the sequencing for you.
+# Feel free to call these out of order for specific/specialized tasks, but don't yell at me if something breaks :)
+
+# Synchronize local block collection with Google Cloud bucket, then return the listing of files not yet ingested.
+# If BUCKET_NAME points at a local directory instead, that directory stands in for the bucket.
+def download():
+    output = fetch()
+    return Manifest(location("MANIFEST", "manifest.sqlite")).pending(output)
+
+
+# Brings OUTPUT_DIR up to date with the bucket (or the local directory standing in for one), and returns its path.
+def fetch():
+    output = location("OUTPUT_DIR", "mina_mainnet_blocks")
+    bucket = setting("BUCKET_NAME", "mina_mainnet_blocks")
+    Path(output).mkdir(parents=True, exist_ok=True)
+    if Path(bucket).is_dir():
+        print(f"Synchronizing local directory: {bucket}")
+        synchronize(bucket, output)
+    else:
+        command = f"gsutil -m rsync -r gs://{bucket} {output}"
+        print(f"Running command: {command}")
+        subprocess.run(command.split(), stdout=subprocess.PIPE, text=True)
+    return output
+
+
+# Copies over any files present in the source directory but missing from the destination. Each copy is written under a
+# temporary name first, so a half-copied block is never mistaken for a real one.
+def synchronize(source, destination):
+    for name in set(os.listdir(source)) - set(os.listdir(destination)):
+        if not Manifest.eligible(name):
+            continue
+        temporary = os.path.join(destination, f".{name}.tmp")
+        shutil.copyfile(os.path.join(source, name), temporary)
+        os.replace(temporary, os.path.join(destination, name))
+
+
+# The only fields we keep from each block. In a precomputed block they all live in 'protocol_state', which comes before
+# the (much larger) proof and staged ledger diff, so they can be picked out of the first few KB of the file.
+FIELD_PATTERN = re.compile(r'"(scheduled_time|previous_state_hash|block_creator|global_slot_since_genesis|'
+                           r'supercharge_coinbase)"\s*:\s*("(?:[^"\\]|\\.)*"|true|false|-?\d+)')
+FIELD_COUNT = 5
+CHUNK_SIZE = 16384
+
+
+# Pulls the state hash out of a block's file name. Only the name itself counts, as the directories above it (a network's
+# own, for one) may have dashes in them too.
+def state_hash_of(file):
+    return os.path.basename(file).split("-")[1].split(".")[0]
+
+
+# Builds the pruned block layout that gets stored in the master.
+def prune(timestamp, previous_state_hash, creator, height, charged):
+    block = dict()
+    block["protocol_state"] = {}
+    block["protocol_state"]["body"] = {}
+    block["protocol_state"]["body"]["consensus_state"] = {}
+    block["scheduled_time"] = timestamp
+    block["protocol_state"]["previous_state_hash"] = previous_state_hash
+    block["protocol_state"]["body"]["consensus_state"]["block_creator"] = creator
+    block["protocol_state"]["body"]["consensus_state"]["global_slot_since_genesis"] = height
+    block["protocol_state"]["body"]["consensus_state"]["supercharge_coinbase"] = charged
+    return block
+
+
+# Reads in an entire block file and prunes it. Slow for big blocks, but makes no assumptions about the file's layout.
+def extract_full(file):
+    with open(file, "r", encoding="ISO-8859-1") as json_file:
+        block = json.loads(json_file.read())
+    consensus_state = block["protocol_state"]["body"]["consensus_state"]
+    return state_hash_of(file), prune(block["scheduled_time"], block["protocol_state"]["previous_state_hash"],
+                                      consensus_state["block_creator"], consensus_state["global_slot_since_genesis"],
+                                      consensus_state["supercharge_coinbase"])
+
+
+# Reads a block file a chunk at a time only until all of the fields we keep have been seen, then prunes it.
+# Falls back to extract_full() if the file ends before they have all turned up.
+def extract(file):
+    fields = {}
+    contents = ""
+    with open(file, "r", encoding="ISO-8859-1") as json_file:
+        while len(fields) < FIELD_COUNT:
+            chunk = json_file.read(CHUNK_SIZE)
+            if not chunk:
+                return extract_full(file)
+            contents += chunk
+            # A value running up to the end of the buffer may be cut off, so leave it until the next chunk is appended
+            for match in FIELD_PATTERN.finditer(contents):
+                if match.end() < len(contents):
+                    fields.setdefault(match.group(1), json.loads(match.group(2)))
+    return state_hash_of(file), prune(fields["scheduled_time"], fields["previous_state_hash"], fields["block_creator"],
+                                      fields["global_slot_since_genesis"], fields["supercharge_coinbase"])
+
+
+def extract_batch(files):
+    return [extract(file) for file in files]
+
+
+# Prune unnecessary data from blocks and organize them into a collection, then return said collection of blocks.
+# Requires a file listing to iterate through; one can be created with the download() function.
+# The collection is a BlockStore, which only ever appends the new blocks to disk. An existing master.json (the old
+# storage format) is imported into it the first time this runs. Once stored, the files are marked as ingested in the
+# manifest so download() won't hand them out again.
+# With more than one worker (PARSE_WORKERS, or the 'workers' parameter), files are parsed across a process pool.
+def parse(block_file_list, workers=None):
+    if workers is None:
+        workers = int(setting("PARSE_WORKERS", 1))
+    master_json = BlockStore(os.path.abspath(location("STORE", "blocks.sqlite")))
+    master_json.migrate(os.path.abspath(location("MASTER", "master.json")))
+
+    # Parsing involves stripping out all info that we do not need from the block, then storing it in the master.
+    new_block_files = [file for file in block_file_list if state_hash_of(file) not in master_json]
+    if workers > 1 and len(new_block_files) > 1:
+        chunksize = max(1, len(new_block_files) // (workers * 4))
+        batches = [new_block_files[start:start + chunksize] for start in range(0, len(new_block_files), chunksize)]
+        for batch in pooled(extract_batch, batches, workers):
+            for state_hash, block in batch:
+                master_json[state_hash] = block
+    else:
+        for file in new_block_files:
+            state_hash, block = extract(file)
+            master_json[state_hash] = block
+    master_json.commit()
+    Manifest(location("MANIFEST", "manifest.sqlite")).mark(block_file_list)
+    return master_json, len(new_block_files)
+
+
+# All of the notifier's derived state (the blockchain, staged forks and so on) is kept in sections of a single snapshot.
+# When running as a daemon, 'resident' holds a single in-memory snapshot that is shared by every cycle instead.
+resident = None
+
+
+def snapshot():
+    current = network.get()
+    if current is not None:
+        return current.snapshot
+    if resident is not None:
+        return resident
+    return Snapshot(location("SNAPSHOT", "snapshot.sqlite"))
+
+
+# In the spirit of making incremental updates as fast as possible, the blockchain will be serialized, like the master.
+# The blockchain remembers how far into the master it has mapped, so only blocks stored since then are read.
+# Blocks already in the slot a new block was produced in are remembered as contested, since the new block makes them
+# alertable; prestage() refreshes the staged segments they are in.
+def blockmap(master):
+    state = snapshot()
+    # Load our past mapping to pick up where we left off, from the old standalone pickle if the snapshot doesn't have it
+    blockchain = state.load("blockchain")
+    changed = blockchain is None
+    if blockchain is None:
+        try:
+            blockchain = pickle.load(open(location("BLOCKCHAIN", "mapping.pickle"), "rb"))
+        except (OSError, IOError):
+            blockchain = Blockchain()
+    contested = state.load("contested", set())
+    count = len(contested)
+
+    for position, item, record in master.since(blockchain.cursor):
+        blockchain.cursor = position
+        # Skip previously mapped blocks from being re-mapped
+        if blockchain.has(item):
+            continue
+        item_hash = item
+        parent = record["protocol_state"]["previous_state_hash"]
+        height = record["protocol_state"]["body"]["consensus_state"]["global_slot_since_genesis"]
+        timestamp = record["scheduled_time"]
+        block = Block(item_hash, parent, height, timestamp)
+        blockchain.add(block)
+        contested.update(blockchain.rivals(item_hash, height))
+        changed = True
+    if len(contested) > count:
+        state.save(blockchain=blockchain, contested=contested)
+    elif changed:
+        state.save(blockchain=blockchain)
+    return blockchain
+
+
+# This will validate the blockchain, update both the blockchain and master with any corrections, and save both to file.
+def validate(blockchain, master, verbose):
+    explorer = Explorer(setting("EXPLORER_URL"), location("EXPLORER_CACHE", "explorer.sqlite"), session=session)
+    report = blockchain.validate(master, verbose, explorer)
+    explorer.close()
+    snapshot().save(blockchain=blockchain)
+    master.commit()
+    return report
+
+
+# Marks the canonical chain as such, and saves the blockchain if anything changed.
+# Painting is incremental: only the segment between the new tip and its common ancestor with the previously painted tip
+# is touched, and the abandoned branch of a reorg is un-painted. Returns an event describing the change (with the
+# 'orphaned' and 'canonical' hashes listed oldest first), or None if the canonical tip hasn't moved.
+def paint(blockchain):
+    tip = blockchain.canonical()
+    previous = blockchain.get(blockchain.painted)
+    # The oldest canonical block is the bottom of the painted chain. If its parent has turned up since, the chain was
+    # painted while cut off from the blocks below it, which were left unpainted - so the whole chain is repainted.
+    if previous is not None and len(blockchain.resolved) and \
+            blockchain.has(blockchain.get(blockchain.resolved.hashes[0]).parent):
+        previous = None
+    if tip is None or tip == previous:
+        return None
+    event = {"tip": tip.hash, "previous": blockchain.painted, "ancestor": None, "orphaned": [], "canonical": []}
+
+    if previous is None:
+        # Nothing reliable to start from (first run, legacy pickle, or the old tip was removed), so repaint everything.
+        stale = {block.hash for block in blockchain.blocks.values() if block.canon}
+        for block_hash in stale:
+            blockchain.get(block_hash).canon = False
+        blockchain.resolved = TimestampIndex()
+        block = tip
+        while block is not None:
+            block.canon = True
+            blockchain.resolved.add(int(block.timestamp), block.hash)
+            if block.hash not in stale:
+                event["canonical"].append(block.hash)
+            stale.discard(block.hash)
+            block = blockchain.get(block.parent)
+        event["canonical"].reverse()
+        event["orphaned"] = sorted(stale, key=lambda h: int(blockchain.get(h).height))
+    else:
+        # Walk back from the new tip to the first block that is already canonical; that's the common ancestor
+        segment = []
+        block = tip
+        while block is not None and not block.canon:
+            segment.append(block)
+            block = blockchain.get(block.parent)
+        ancestor = block
+        # Un-paint the old canonical chain down to the ancestor - this is a no-op when the tip simply advanced
+        block = previous
+        while block is not None and block != ancestor and block.canon:
+            block.canon = False
+            blockchain.resolved.discard(int(block.timestamp), block.hash)
+            event["orphaned"].append(block.hash)
+            block = blockchain.get(block.parent)
+        for block in segment:
+            block.canon = True
+            blockchain.resolved.add(int(block.timestamp), block.hash)
+            event["canonical"].append(block.hash)
+        event["ancestor"] = ancestor.hash if ancestor is not None else None
+        event["orphaned"].reverse()
+        event["canonical"].reverse()
+
+    blockchain.painted = tip.hash
+    snapshot().save(blockchain=blockchain)
+    return event
+
+
+# Mina's coinbase, in MINA: 1440 if the block is supercharged, otherwise 720.
+def coinbase(record):
+    return 1440 if record["protocol_state"]["body"]["consensus_state"]["supercharge_coinbase"] else 720
+
+
+STATISTICS_FIELDS = ("produced", "orphaned", "mina_lost", "battles_won", "battles_lost")
+SLOTS_PER_EPOCH = 7140
+
+
+# Running totals per block producer and per epoch, kept up to date a block and a reorg at a time by tally() rather than
+# recounted from the whole chain. Each set of totals holds, in STATISTICS_FIELDS order: blocks produced, blocks that are
+# currently orphaned, the coinbase lost on those, and same-slot battles won and lost. A battle is a slot with more than
+# one block in it; the canonical block wins it and every other block in it loses.
+# 'battles' remembers how each block in a contested slot was last counted, so it can be taken back out when the slot
+# changes.
+class Statistics:
+    def __init__(self):
+        self.producers = {}
+        self.epochs = {}
+        self.battles = {}
+        # How far into the block store blocks have been counted, and the canonical tip they were counted against
+        self.cursor = 0
+        self.painted = None
+        # Producers and epochs whose totals changed since they were last exported
+        self.dirty = set()
+
+    def count(self, creator, slot, field, amount):
+        if amount:
+            epoch = int(slot) // SLOTS_PER_EPOCH
+            self.producers.setdefault(creator, [0] * len(STATISTICS_FIELDS))[field] += amount
+            self.epochs.setdefault(epoch, [0] * len(STATISTICS_FIELDS))[field] += amount
+            self.dirty.add(("producers", creator))
+            self.dirty.add(("epochs", epoch))
+
+    # Counts a newly produced block, canonical or not.
+    def add(self, creator, slot, reward, canon):
+        self.count(creator, slot, 0, 1)
+        if not canon:
+            self.count(creator, slot, 1, 1)
+            self.count(creator, slot, 2, reward)
+
+    # Moves a block that was already counted into or out of the canonical chain.
+    def flip(self, creator, slot, reward, canon):
+        sign = -1 if canon else 1
+        self.count(creator, slot, 1, sign)
+        self.count(creator, slot, 2, sign * reward)
+
+    # Recounts the battle for a slot, given the (creator, canon) of every block in it by hash.
+    def battle(self, slot, blocks):
+        for creator, canon in self.battles.pop(slot, {}).values():
+            self.count(creator, slot, 3 if canon else 4, -1)
+        if len(blocks) > 1:
+            self.battles[slot] = blocks
+            for creator, canon in blocks.values():
+                self.count(creator, slot, 3 if canon else 4, 1)
+
+    # Forgets how the battles below the given slot were counted once the blockchain has none of their blocks left; they
+    # are final, so they can't change any more.
+    def settle(self, slot, blockchain):
+        for contested in [contested for contested in self.battles if contested < slot]:
+            if not blockchain.rivals(None, contested):
+                del self.battles[contested]
+
+    # Returns a producer's totals by name, all zero if it has never produced a block.
+    def producer(self, creator):
+        return dict(zip(STATISTICS_FIELDS, self.producers.get(creator, [0] * len(STATISTICS_FIELDS))))
+
+    # Returns an epoch's totals by name.
+    def epoch(self, epoch):
+        return dict(zip(STATISTICS_FIELDS, self.epochs.get(int(epoch), [0] * len(STATISTICS_FIELDS))))
+
+    # Returns a multi-path update of every total that changed since the last export, and marks them as exported.
+    def export(self):
+        changes = {f"{kind}/{key}": self.producer(key) if kind == "producers" else self.epoch(key)
+                   for kind, key in sorted(self.dirty, key=str)}
+        self.dirty.clear()
+        return changes
+
+
+# Brings the producer and epoch statistics up to date with the painted chain, and returns them. New blocks are counted
+# as they are now; blocks counted before are moved by the reorg 'event' from paint(). Should an event have been missed
+# (the last cycle stopped between painting and tallying), the statistics are counted again from scratch. Blocks that
+# were archived before they were ever counted are looked up in the archive, though their battles can't be.
+def tally(blockchain, master, event):
+    state = snapshot()
+    statistics = state.load("statistics")
+    previous = event["previous"] if event else blockchain.painted
+    if statistics is None or (statistics.cursor and statistics.painted != previous):
+        statistics = Statistics()
+    changed = statistics.painted != blockchain.painted
+    # Slots whose battles have to be recounted, each with a block in it to find the others by
+    slots = {}
+    counted = set()
+    cold = None
+
+    for position, block_hash, record in master.since(statistics.cursor):
+        statistics.cursor = position
+        changed = True
+        block = blockchain.get(block_hash)
+        consensus_state = record["protocol_state"]["body"]["consensus_state"]
+        if block is not None:
+            canon = block.canon
+            slots[int(consensus_state["global_slot_since_genesis"])] = block_hash
+        else:
+            cold = cold or Archive(location("ARCHIVE", "archive.sqlite"))
+            archived = cold.block(block_hash)
+            if archived is None:
+                continue
+            canon = archived["canon"]
+        statistics.add(consensus_state["block_creator"], consensus_state["global_slot_since_genesis"],
+                       coinbase(record), canon)
+        counted.add(block_hash)
+    if cold is not None:
+        cold.close()
+
+    if event:
+        for block_hash in event["orphaned"] + event["canonical"]:
+            if block_hash in counted:
+                continue
+            record = master[block_hash]
+            consensus_state = record["protocol_state"]["body"]["consensus_state"]
+            statistics.flip(consensus_state["block_creator"], consensus_state["global_slot_since_genesis"],
+                            coinbase(record), blockchain.get(block_hash).canon)
+            slots[int(consensus_state["global_slot_since_genesis"])] = block_hash
+
+    for slot, block_hash in slots.items():
+        rivals = blockchain.rivals(block_hash, slot)
+        if rivals or slot in statistics.battles:
+            # Blocks archived out of a battle that is still going on keep the part they had in it
+            contenders = {contender: part for contender, part in statistics.battles.get(slot, {}).items()
+                          if not blockchain.has(contender)}
+            for contender in [block_hash] + rivals:
+                contenders[contender] = (master[contender]["protocol_state"]["body"]["consensus_state"][
+                    "block_creator"], blockchain.get(contender).canon)
+            statistics.battle(slot, contenders)
+
+    statistics.painted = blockchain.painted
+    if changed:
+        state.save(statistics=statistics)
+    return statistics
+
+
+# The per-block lists of a staged fork's 'blocks', which a segment holds for its own blocks
+BLOCK_FIELDS = ("block", "timestamp", "creator", "alertable")
+
+
+# The non-canonical part of the blockchain, as a tree of shared segments. A segment is a run of blocks with nothing
+# branching off in between: it ends at a fork's head, at a block with more than one child, or at the head of a fork that
+# was staged before (so a fork that keeps growing only ever adds a segment at a time). Each fork is the list of segments
+# from where it left the canonical chain up to its head, so forks that share a stem share its segments as well.
+class ForkTree:
+    def __init__(self):
+        # Segment ID -> hashes of the segment's blocks, oldest first
+        self.segments = {}
+        # Every fork, as a list of segment IDs, oldest first
+        self.forks = []
+        # Hash of the newest block in a segment -> the segment IDs from the canonical chain up to and including it
+        self.paths = {}
+
+    def __len__(self):
+        return len(self.forks)
+
+    def __iter__(self):
+        return iter(self.forks)
+
+    # Adds the fork ending in 'head', walking back only as far as the first segment some other fork already reached.
+    def branch(self, blockchain, head, stops):
+        path = []
+        found = []
+        block = head
+        # Stop at a missing parent as well, since a detached fork has no canonical block to walk back to
+        while block is not None and not block.canon:
+            if block.hash in self.paths:
+                path = self.paths[block.hash]
+                break
+            hashes = []
+            while True:
+                hashes.append(block.hash)
+                parent = blockchain.get(block.parent)
+                if parent is None or parent.canon or parent.hash in stops or \
+                        len(blockchain.successors(parent.hash)) > 1:
+                    break
+                block = parent
+            found.append(hashes)
+            block = parent
+        for hashes in reversed(found):
+            hashes.reverse()
+            segment_id = hashlib.md5((hashes[0] + hashes[-1]).encode("utf-8")).hexdigest()
+            self.segments[segment_id] = hashes
+            path = path + [segment_id]
+            self.paths[hashes[-1]] = path
+        self.forks.append(path)
+        return path
+
+
+# Creates a tree of forks from the blockchain and returns it
+# Only the forks ending in the given heads are gathered, if any are given; otherwise every endpoint is.
+def process(blockchain, heads=None):
+    forks = ForkTree()
+    # Heads of forks that have already been staged end a segment, so the blocks below them are shared and not restaged
+    stops = snapshot().load("latest") or set()
+
+    for head in blockchain.endpoints() if heads is None else heads:
+        if head.canon:  # The canonical head is technically an endpoint, so skip it
+            continue
+        forks.branch(blockchain, head, stops)
+    return forks
+
+
+# This will unpack our stored staged forks (if available), so that we only do work on new or updated forks
+# The staged forks, their segments and the set of latest blocks are kept together in the snapshot, and only written back
+# if they changed
+# The segments of the forks being staged can be built across a process pool; see build_segments()
+def prestage(forks, blocks, blockchain, workers=None):
+    state = snapshot()
+    # Staged is used to store previously staged forks
+    staged = state.load("staged")
+    # Segments holds the staged segments the forks are made of, by segment ID
+    segments = state.load("segments", {})
+    # Latest is used to store the most recently processed blocks within all known forks
+    latest = state.load("latest")
+    # Unsent is used to store the IDs of forks staged since the last upload (None means they have never been tracked),
+    # and the IDs of segments staged or changed since then
+    unsent = state.load("unsent")
+    unsent_segments = state.load("unsent_segments", set())
+
+    # Carry over the old standalone staging and latest files, if the snapshot doesn't have them yet
+    changed = staged is None
+    if staged is None:
+        staging = location("STAGING", "staging.json")
+        if Path(staging).is_file():
+            with open(staging, "r", encoding="ISO-8859-1") as staging_file:
+                staged = json.loads(staging_file.read())
+        else:
+            staged = {}
+        try:
+            latest = pickle.load(open(location("LATEST", "latest.pickle"), "rb"))
+        except (OSError, IOError):
+            latest = set()
+
+    # Resolved and Alertable rely only on the main blockchain data, so the blockchain keeps them up to date itself
+    # Resolved is a sorted index of the canonical chain's timestamps, maintained by paint()
+    # Alertable is the blockchain's slot index, which maps each slot to the hashes of every block produced in it
+    resolved = blockchain.resolved
+    alertable = blockchain
+
+    # Update latest as necessary
+    for block in staged:
+        if staged[block]["latest"] not in latest:
+            latest.add(staged[block]["latest"])
+            changed = True
+        # A fork staged before any canonical block came after its head isn't staged again just for that, since its head
+        # hasn't moved - so it's resolved here, once the canonical chain does get past it
+        if not staged[block]["resolved_at"] and "segments" in staged[block]:
+            head = segments[staged[block]["segments"][-1]]
+            resolved_at = resolved.successor(head["timestamp"][-1])
+            if resolved_at:
+                staged[block]["resolved_at"] = resolved_at
+                if unsent is not None:
+                    unsent.add(block)
+                changed = True
+
+    # Check head of fork to "latest" field in staged forks - if they match, the staged fork is up to date
+    # Go ahead with staging if the fork is not up to date within the staged forks
+    pending = [fork for fork in forks if forks.segments[fork[-1]][-1] not in latest]
+    # Every segment is staged (or has its alertable blocks refreshed) once, however many of the forks share it
+    segment_ids = list(dict.fromkeys(segment_id for fork in pending for segment_id in fork))
+    built = build_segments([forks.segments[segment_id] for segment_id in segment_ids], blocks, alertable, workers)
+    # Segments staged or changed this time round, which every fork made of them has to be sent again for
+    refreshed = set()
+    for segment_id, segment in zip(segment_ids, built):
+        if stage_segment(segments, segment_id, segment):
+            unsent_segments.add(segment_id)
+            refreshed.add(segment_id)
+    for fork in pending:
+        fork_hash = stage(staged, fork, segments, blocks, resolved)
+        # Taken into latest straight away, rather than by the next cycle, which would then have something to save
+        latest.add(staged[fork_hash]["latest"])
+        if unsent is not None:
+            unsent.add(fork_hash)
+        changed = True
+
+    # Rivals can turn up long after a segment was staged, and without its forks growing, so the segments holding blocks
+    # that have been contested since (see blockmap()) have their alertable blocks refreshed as well
+    contested = state.load("contested", set())
+    if contested:
+        for segment_id, segment in segments.items():
+            if contested.isdisjoint(segment["block"]):
+                continue
+            # Blocks already archived keep the rivals they had, as none can turn up for them any more
+            fresh = [alertable.rivals(block, alertable.get(block).height) if alertable.has(block) else rivals
+                     for block, rivals in zip(segment["block"], segment["alertable"])]
+            if fresh != segment["alertable"]:
+                segment["alertable"] = fresh
+                unsent_segments.add(segment_id)
+                refreshed.add(segment_id)
+        changed = True
+    if refreshed and unsent is not None:
+        for fork_hash, fork in staged.items():
+            if not refreshed.isdisjoint(fork.get("segments", ())):
+                unsent.add(fork_hash)
+
+    # Re-serialization
+    if changed:
+        sections = {"contested": set()} if contested else {}
+        state.save(staged=staged, segments=segments, latest=latest, unsent=unsent, unsent_segments=unsent_segments,
+                   **sections)
+    return staged
+
+
+# Works out a segment of a fork from the given block hashes, oldest first.
+def build_segment(hashes, blocks, alert):
+    data = [blocks[block] for block in hashes]
+    # Blocks in segment inserted such that oldest block is at index 0, with the newest block winning ties for 'latest'
+    segment = {"block": list(hashes), "timestamp": [], "creator": [], "alertable": [], "rewards": 0, "latest": '',
+               "last_updated": 0}
+    for block, block_data in zip(hashes, data):
+        timestamp = int(block_data["scheduled_time"])
+        segment["timestamp"].append(timestamp)
+        segment["creator"].append(block_data["protocol_state"]["body"]["consensus_state"]["block_creator"])
+        # Add 1440 mina to "lost rewards" if the block is supercharged, otherwise 720
+        segment["rewards"] += coinbase(block_data)
+        if timestamp >= segment["last_updated"]:
+            segment["last_updated"] = timestamp
+            segment["latest"] = block
+        # Alertable check - lists every other block in the blockchain produced at the same slot as this current one
+        segment["alertable"].append(alert.rivals(block, block_data["protocol_state"]["body"]["consensus_state"][
+            "global_slot_since_genesis"]))
+    return segment
+
+
+# Fewer segments than this aren't worth starting a pool of staging workers for
+PARALLEL_STAGING_MIN = 64
+
+
+# What a staging worker builds segments from: a mapped copy of the blockchain, and the block store. Each worker opens
+# its own from their paths, so neither has to be pickled over to it, and keeps them for the rest of the batches it's
+# given from the same paths. A worker in a shared pool may be handed another network's batches next.
+staging_inputs = None
+
+
+def build_segment_batch(chain_path, store_path, batch):
+    global staging_inputs
+    if staging_inputs is None or staging_inputs[:2] != (chain_path, store_path):
+        if staging_inputs is not None:
+            staging_inputs[2].close()
+        staging_inputs = (chain_path, store_path, BlockStore(store_path), Blockchain.load(chain_path))
+    blocks, alert = staging_inputs[2:]
+    return [build_segment(hashes, blocks, alert) for hashes in batch]
+
+
+# Works out a segment for each list of block hashes given, in order.
+# With more than one worker (STAGE_WORKERS, or the 'workers' parameter), and enough segments to be worth it, they're
+# built across a process pool. The workers share the read-only indexes rather than copying them: the blockchain is
+# dumped to a chain file once, which every worker maps (see Blockchain.load()), and they read from the block store's
+# own file. Results come back in the order given, so staging them is no different from the serial path.
+def build_segments(segments, blocks, alert, workers=None):
+    if workers is None:
+        workers = int(setting("STAGE_WORKERS", 1))
+    if workers <= 1 or len(segments) < PARALLEL_STAGING_MIN or not isinstance(blocks, BlockStore):
+        return [build_segment(hashes, blocks, alert) for hashes in segments]
+
+    with tempfile.TemporaryDirectory() as scratch:
+        chain_path = os.path.join(scratch, "blockchain")
+        alert.dump(chain_path)
+        batch_size = -(-len(segments) // (workers * 4))
+        batches = [segments[start:start + batch_size] for start in range(0, len(segments), batch_size)]
+        work = partial(build_segment_batch, chain_path, blocks.path)
+        return [segment for batch in pooled(work, batches, workers) for segment in batch]
+
+
+# Stages a freshly built segment into 'segments' under its ID. A segment staged before only takes the new alertable
+# blocks, since rivals can turn up later; the rest can't have changed. Returns whether anything did.
+def stage_segment(segments, segment_id, segment):
+    staged_segment = segments.get(segment_id)
+    if staged_segment is None:
+        segments[segment_id] = segment
+        return True
+    if staged_segment["alertable"] == segment["alertable"]:
+        return False
+    staged_segment["alertable"] = segment["alertable"]
+    return True
+
+
+# Prepares the fork data to be received properly by the FireBase database, and returns the fork's unique ID.
+# The fork only refers to its segments by ID; expand() writes its blocks out in full.
+def stage(staging, fork, segments, blocks, resolved):
+    # 'staged_fork' contains all data for a given fork
+    staged_fork = {"length": 0, "segments": list(fork), "rewards": 0, "latest": '', "last_updated": 0,
+                   "resolved_at": ''}
+    # The newest block in the fork (its head) is used for both the resolution lookup and the unique ID hash
+    fork_root = segments[fork[-1]]["block"][-1]
+
+    # Resolved At check - checks for the earliest canonical block after the current end of the fork
+    staged_fork["resolved_at"] = resolved.successor(int(blocks[fork_root]["scheduled_time"])) or ''
+
+    for segment_id in fork:
+        segment = segments[segment_id]
+        staged_fork["length"] += len(segment["block"])
+        staged_fork["rewards"] += segment["rewards"]
+        # Update the 'latest' and 'last_updated' fields according to our most recent block
+        if segment["last_updated"] >= staged_fork["last_updated"]:
+            staged_fork["last_updated"] = segment["last_updated"]
+            staged_fork["latest"] = segment["latest"]
+
+    # Unique ID is MD5 generated from the timestamp of the first block in the fork combined with its state hash
+    fork_combo = fork_root + blocks[fork_root]["scheduled_time"] + \
+        blocks[fork_root]["protocol_state"]["body"]["consensus_state"]["block_creator"]
+    fork_hash = hashlib.md5(fork_combo.encode("utf-8")).hexdigest()
+    staging[fork_hash] = staged_fork
+    return fork_hash
+
+
+# Returns a staged fork in the layout FireBase has always had, with the blocks of its segments written out in full.
+# Forks staged before segments were introduced already are in that layout, and are returned as they are.
+def expand(fork, segments):
+    if "segments" not in fork:
+        return fork
+    expanded = {key: value for key, value in fork.items() if key != "segments"}
+    expanded["blocks"] = {field: [] for field in BLOCK_FIELDS}
+    for segment_id in fork["segments"]:
+        for field, values in expanded["blocks"].items():
+            values.extend(segments[segment_id][field])
+    return expanded
+
+
+# Sends the given entries to the backend as multi-path updates of at most 'limit' bytes each. Returns the bytes sent.
+def send(backend, entries, limit):
+    batch = {}
+    size = 0
+    sent = 0
+    for key, value in entries:
+        length = len(json.dumps(value, ensure_ascii=False))
+        if batch and size + length > limit:
+            backend.update(batch)
+            sent += size
+            batch = {}
+            size = 0
+        batch[key] = value
+        size += length
+    if batch:
+        backend.update(batch)
+        sent += size
+    return sent
+
+
+# Pushes changes to a FireBase database (or any other backend, see backends.py).
+# Requires valid data to be contained within its input parameters - this can be obtained using the stage() function.
+# Only forks staged since the last successful upload are sent, as multi-path updates of at most UPLOAD_BATCH_BYTES
+# each. If nothing has been tracked yet, every staged fork is sent once. Returns the number of forks and bytes sent.
+# Forks are sent with their blocks written out, unless UPLOAD_SEGMENTS is set: then they're sent as staged, referring to
+# their segments by ID, and the new or changed segments go to 'segment_backend' (SEGMENTS_ROOT, "segments" by default)
+# first, so a shared stem is only ever sent once. With UPLOAD_STATISTICS set, the producer and epoch statistics that
+# changed go to 'statistics_backend' (STATISTICS_ROOT, "statistics" by default) as well.
+def firebase_update(staging, backend=None, segment_backend=None, statistics_backend=None):
+    if backend is None:
+        backend = FirebaseBackend(firebase_root("FORKS_ROOT", "forks"))
+    state = snapshot()
+    segments = state.load("segments", {})
+    unsent = state.load("unsent")
+    unsent_segments = state.load("unsent_segments", set())
+    # Once everything has been sent, the sections only have to be cleared if there was something in them
+    clear = unsent is None or unsent or unsent_segments
+    if unsent is None:
+        unsent = set(staging)
+        unsent_segments = set(segments)
+    limit = int(setting("UPLOAD_BATCH_BYTES", 1000000))
+
+    sent = 0
+    forks = ((fork_hash, staging[fork_hash]) for fork_hash in sorted(unsent) if fork_hash in staging)
+    if setting("UPLOAD_SEGMENTS"):
+        if segment_backend is None:
+            segment_backend = FirebaseBackend(firebase_root("SEGMENTS_ROOT", "segments"))
+        # A segment's totals are only needed for staging, so just its blocks are sent, laid out as in a fork's 'blocks'
+        sent += send(segment_backend, ((segment_id, {field: segments[segment_id][field] for field in BLOCK_FIELDS})
+                                       for segment_id in sorted(unsent_segments) if segment_id in segments), limit)
+        sent += send(backend, forks, limit)
+    else:
+        sent += send(backend, ((fork_hash, expand(fork, segments)) for fork_hash, fork in forks), limit)
+    if clear:
+        state.save(unsent=set(), unsent_segments=set())
+    statistics = state.load("statistics")
+    if setting("UPLOAD_STATISTICS") and statistics is not None and statistics.dirty:
+        if statistics_backend is None:
+            statistics_backend = FirebaseBackend(firebase_root("STATISTICS_ROOT", "statistics"))
+        sent += send(statistics_backend, statistics.export().items(), limit)
+        state.save(statistics=statistics)
+    return len(unsent), sent
+
+
+# Moves everything below the finality horizon out of the hot state and into the cold archive (ARCHIVE, archive.sqlite by
+# default). The horizon is FINALITY blocks below the canonical tip - 290 by default, Mina's k, past which blocks can't
+# be reorged - counted in blocks along the canonical chain rather than in slots. Final blocks leave the blockchain, and
+# staged forks whose blocks have all gone (and have been uploaded) leave staging, along with their entries in latest and
+# any segments no other fork shares.
+# Everything archived can still be looked up on demand (see Archive in store.py), while the state every cycle works on
+# stays the same size no matter how old the chain gets. Returns the number of blocks and forks archived.
+def archive(blockchain):
+    tip = blockchain.canonical()
+    if tip is None or blockchain.painted != tip.hash:
+        return 0, 0
+    horizon = tip
+    for _ in range(int(setting("FINALITY", 290))):
+        horizon = blockchain.get(horizon.parent)
+        if horizon is None:
+            return 0, 0
+    final = int(horizon.height)
+    blocks = blockchain.finalize(final)
+
+    state = snapshot()
+    statistics = state.load("statistics")
+    if statistics is not None:
+        statistics.settle(final, blockchain)
+    staged = state.load("staged", {})
+    segments = state.load("segments", {})
+    latest = state.load("latest", set())
+    unsent = state.load("unsent")
+    forks = {fork_hash: expand(fork, segments) for fork_hash, fork in staged.items()
+             if not blockchain.has(fork["latest"]) and (unsent is None or fork_hash not in unsent)}
+    if not blocks and not forks:
+        return 0, 0
+
+    # The archive is written first; should the snapshot not follow, the next cycle simply archives the same again
+    # Archived forks are written out in full, so the archive doesn't depend on segments that may since have gone
+    cold = Archive(location("ARCHIVE", "archive.sqlite"))
+    cold.store([(block.hash, block.parent, block.height, block.timestamp, block.canon) for block in blocks], forks)
+    cold.close()
+    for fork_hash in forks:
+        del staged[fork_hash]
+    if forks:
+        shared = {segment_id for fork in staged.values() for segment_id in fork.get("segments", ())}
+        segments = {segment_id: segment for segment_id, segment in segments.items() if segment_id in shared}
+    latest = {block_hash for block_hash in latest if blockchain.has(block_hash)}
+    state.save(blockchain=blockchain, staged=staged, segments=segments, latest=latest)
+    if statistics is not None:
+        state.save(statistics=statistics)
+    return len(blocks), len(forks)
+
+
+# Reset everything and run from the top, optionally with printouts based on boolean parameter.
+# Every stage (and the cycle as a whole) is timed and counted in the metrics module, which are exported to METRICS_FILE
+# at the end, if it's set.
+def powercycle(printout=False, integrity_check=False):
+    try:
+        with metrics.timed("cycle"):
+            # Download Blocks
+            with metrics.timed("download") as timer:
+                files = download()
+            if printout:
+                print(f"{len(files)} new Blocks Synchronized in {timer.seconds} seconds")
+            # A backlog is parsed CYCLE_MAX_FILES files at a time, leaving the rest of the pipeline until it's been
+            # caught up on, so no one cycle runs for long (and, with several networks, holds up the others)
+            limit = int(setting("CYCLE_MAX_FILES", 0))
+            backlog = len(files) - limit if 0 < limit < len(files) else 0
+            if backlog:
+                files = files[:limit]
+
+            # Parse Blocks
+            with metrics.timed("parse") as timer:
+                master, new_files = parse(files)
+            metrics.NEW_BLOCKS.inc(new_files)
+            if printout:
+                print(f"Parsed {new_files} new Blocks in {timer.seconds} seconds.")
+            if backlog:
+                if printout:
+                    print(f"{backlog} Blocks left to catch up on.")
+                return
+
+            # Map Blocks
+            with metrics.timed("blockmap") as timer:
+                blockchain = blockmap(master)
+            if printout:
+                print(f"Mapped all Blocks in {timer.seconds} seconds.")
+
+            # Validate the blockchain to fix any potential errors before we do work
+            # This takes a long time, so you should only do it if you think there's a problem.
+            if integrity_check:
+                with metrics.timed("validate") as timer:
+                    report = validate(blockchain, master, printout)
+                if printout:
+                    print(f"Verified Blockchain integrity in {timer.seconds} seconds.")
+                    print(report)
+
+            # Determine canonical status of entire blockchain information
+            with metrics.timed("paint") as timer:
+                event = paint(blockchain)
+            if printout:
+                print(f"Painted canonical chain in {timer.seconds} seconds.")
+                if event and event["orphaned"]:
+                    print(f"Reorg at {event['ancestor']}: {len(event['orphaned'])} Blocks orphaned, "
+                          f"{len(event['canonical'])} Blocks made canonical.")
+
+            # Count the new blocks and any reorg into the producer and epoch statistics
+            with metrics.timed("tally") as timer:
+                tally(blockchain, master, event)
+            if printout:
+                print(f"Tallied producer statistics in {timer.seconds} seconds.")
+
+            # Sort forked blocks into arrays of unique forks
+            with metrics.timed("process") as timer:
+                forks = process(blockchain)
+            metrics.FORKS.set(len(forks))
+            if printout:
+                print(f"Processed {len(forks)} Forks in {timer.seconds} seconds.")
+
+            # Place forks into JSON data for upload
+            with metrics.timed("prestage") as timer:
+                staging = prestage(forks, master, blockchain)
+            metrics.STAGED_FORKS.set(len(staging))
+            if printout:
+                print(f"Staged {len(staging)} forks for upload in {timer.seconds} seconds.")
+
+            # # Upload to firebase database
+            with metrics.timed("firebase_update") as timer:
+                uploaded, size = firebase_update(staging)
+            metrics.UPLOADED_FORKS.inc(uploaded)
+            metrics.UPLOADED_BYTES.inc(size)
+            if printout:
+                print(f"Uploaded {uploaded} changed forks ({size} bytes) to the FireBase database in {timer.seconds} "
+                      f"seconds.")
+
+            # Move whatever has become final out of the working state
+            with metrics.timed("archive") as timer:
+                archived_blocks, archived_forks = archive(blockchain)
+            metrics.ARCHIVED_BLOCKS.inc(archived_blocks)
+            metrics.ARCHIVED_FORKS.inc(archived_forks)
+            metrics.HOT_BLOCKS.set(len(blockchain.blocks))
+            if printout:
+                print(f"Archived {archived_blocks} final Blocks and {archived_forks} resolved forks in "
+                      f"{timer.seconds} seconds.")
+    finally:
+        metrics.export()
+
+
+if __name__ == '__main__':
+    powercycle(printout=True, integrity_check=False)
@@ -0,0 +1,332 @@
+# Imports
+from collections.abc import Mapping
+import json
+import os
+from pathlib import Path
+import pickle
+import sqlite3
+import time
+
+
+# Append-only storage for parsed blocks, backed by a single SQLite table keyed by state hash.
+# It behaves like the old master.json dict (read-only Mapping plus item assignment), and hands back each block in the
+# same nested layout parse() has always produced, so the rest of the notifier doesn't need to know the difference.
+# Only new records are ever written, and records are only read when asked for by hash.
+class BlockStore(Mapping):
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS blocks ("
+                                "state_hash TEXT PRIMARY KEY, "
+                                "previous_state_hash TEXT, "
+                                "scheduled_time TEXT, "
+                                "block_creator TEXT, "
+                                "global_slot_since_genesis TEXT, "
+                                "supercharge_coinbase INTEGER)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.connection.commit()
+
+    # Rebuilds the nested block layout from a row of columns.
+    @staticmethod
+    def record(row):
+        return {
+            "scheduled_time": row[1],
+            "protocol_state": {
+                "previous_state_hash": row[0],
+                "body": {
+                    "consensus_state": {
+                        "block_creator": row[2],
+                        "global_slot_since_genesis": row[3],
+                        "supercharge_coinbase": bool(row[4])
+                    }
+                }
+            }
+        }
+
+    def __getitem__(self, state_hash):
+        row = self.connection.execute("SELECT previous_state_hash, scheduled_time, block_creator, "
+                                      "global_slot_since_genesis, supercharge_coinbase FROM blocks "
+                                      "WHERE state_hash = ?", (state_hash,)).fetchone()
+        if row is None:
+            raise KeyError(state_hash)
+        return self.record(row)
+
+    # Stages a block for writing; nothing reaches the disk until commit() is called.
+    def __setitem__(self, state_hash, block):
+        consensus = block["protocol_state"]["body"]["consensus_state"]
+        self.connection.execute("INSERT OR REPLACE INTO blocks VALUES (?, ?, ?, ?, ?, ?)",
+                                (state_hash, block["protocol_state"]["previous_state_hash"],
+                                 block["scheduled_time"], consensus["block_creator"],
+                                 consensus["global_slot_since_genesis"], consensus["supercharge_coinbase"]))
+
+    def __contains__(self, state_hash):
+        row = self.connection.execute("SELECT 1 FROM blocks WHERE state_hash = ?", (state_hash,)).fetchone()
+        return row is not None
+
+    def __iter__(self):
+        for row in self.connection.execute("SELECT state_hash FROM blocks"):
+            yield row[0]
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM blocks").fetchone()[0]
+
+    # Yields (position, state hash, block) for every record written after the given position, oldest first.
+    # Positions only ever increase, so callers can remember the last one they saw and pick up from there next time.
+    def since(self, position=0):
+        rows = self.connection.execute("SELECT rowid, state_hash, previous_state_hash, scheduled_time, block_creator, "
+                                       "global_slot_since_genesis, supercharge_coinbase FROM blocks "
+                                       "WHERE rowid > ? ORDER BY rowid", (position,))
+        for row in rows:
+            yield row[0], row[1], self.record(row[2:])
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    # One-time import of a legacy master.json. The file itself is left alone; the store just remembers it was imported.
+    def migrate(self, master):
+        if not Path(master).is_file():
+            return 0
+        if self.connection.execute("SELECT 1 FROM meta WHERE key = 'migrated'").fetchone() is not None:
+            return 0
+        with open(master, "r", encoding="ISO-8859-1") as master_file:
+            master_json = json.loads(master_file.read())
+        for state_hash in master_json:
+            self[state_hash] = master_json[state_hash]
+        self.connection.execute("INSERT INTO meta VALUES ('migrated', ?)", (master,))
+        self.commit()
+        return len(master_json)
+
+
+# Persistent record of which block files have already been ingested, so each cycle only has to deal with new ones.
+# Files are tracked by name. A directory whose modification time hasn't changed since the last listing can't have
+# gained any files, so in the common case no listing is needed at all (a directory modified within the last couple of
+# seconds is always re-listed, since some filesystems only keep whole-second modification times). Files that were
+# listed but never marked (say, a crash mid-parse) are kept in a pending table and handed out again on the next call.
+class Manifest:
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS pending (name TEXT PRIMARY KEY)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.connection.execute("CREATE TEMP TABLE listing (name TEXT PRIMARY KEY)")
+        self.connection.commit()
+
+    # Block files are plain JSON; anything else (temporary download files, hidden files) is ignored.
+    @staticmethod
+    def eligible(name):
+        return name.endswith(".json") and not name.startswith(".")
+
+    # Returns the paths of files in the directory that haven't been marked yet, sorted by name.
+    def pending(self, directory):
+        modified = str(os.stat(directory).st_mtime_ns)
+        watermark = self.connection.execute("SELECT value FROM meta WHERE key = ?", (directory,)).fetchone()
+        if watermark is None or watermark[0] != modified:
+            self.connection.execute("DELETE FROM listing")
+            self.connection.executemany("INSERT OR IGNORE INTO listing VALUES (?)",
+                                        ((name,) for name in os.listdir(directory) if self.eligible(name)))
+            self.connection.execute("DELETE FROM pending")
+            self.connection.execute("INSERT INTO pending SELECT name FROM listing "
+                                    "WHERE name NOT IN (SELECT name FROM files)")
+            if time.time_ns() - int(modified) < 2000000000:
+                modified = ""
+            self.connection.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (directory, modified))
+            self.connection.commit()
+        return [os.path.join(directory, row[0]) for row in
+                self.connection.execute("SELECT name FROM pending ORDER BY name")]
+
+    # Records the given files as ingested.
+    def mark(self, files):
+        names = [(os.path.basename(file),) for file in files]
+        self.connection.executemany("INSERT OR IGNORE INTO files VALUES (?)", names)
+        self.connection.executemany("DELETE FROM pending WHERE name = ?", names)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+SNAPSHOT_VERSION = 2
+
+
+# Stands in for a section that is kept in a file of its own, next to the snapshot, rather than pickled into it. Any
+# value with a dump(path) method, and a load(path) class method to match, is saved this way - like the blockchain, whose
+# chain file can be mapped straight back in. Each generation of the section gets a file of its own, named after the
+# snapshot, the section and the generation; 'name' is the part after the snapshot's path. Snapshots from before then
+# have no name, and kept the section in a file named after the snapshot and the section alone.
+class External:
+    name = None
+
+    def __init__(self, kind, name=None, generation=0):
+        self.kind = kind
+        self.name = name
+        self.generation = generation
+
+    def __getstate__(self):
+        return {"kind": self.kind, "name": self.name}
+
+    # Where the section's file is, for a snapshot at the given path.
+    def path(self, snapshot, section):
+        return f"{snapshot}.{self.name or section}"
+
+
+# Versioned bundle of the notifier's derived state (the mapped blockchain, the staged forks, and so on), kept as named
+# sections in a single SQLite file. Every save() is one transaction and only rewrites the sections it is given, so
+# unchanged state costs nothing to keep and a crash can't leave the sections out of step with each other.
+# A resident snapshot keeps sections in memory once loaded, and save() only marks them as dirty; nothing reaches the
+# disk until checkpoint() is called. Access from several threads has to be serialized by the caller.
+# Sections that can dump themselves to a file (see External) live in files of their own next to the snapshot. A new
+# generation's file is written alongside the current one, and only becomes the section's when the transaction that
+# records its name commits; the old file is removed after that. So a crash at any point leaves every section, external
+# or not, as of the same transaction.
+class Snapshot:
+    def __init__(self, path, resident=False):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS sections (name TEXT PRIMARY KEY, generation INTEGER, "
+                                "data BLOB)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        version = self.connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if version is None:
+            self.connection.execute("INSERT INTO meta VALUES ('version', ?)", (SNAPSHOT_VERSION,))
+        elif int(version[0]) > SNAPSHOT_VERSION:
+            raise ValueError(f"Snapshot {path} is version {version[0]}, newer than supported ({SNAPSHOT_VERSION})")
+        elif int(version[0]) < SNAPSHOT_VERSION:
+            # Older sections still load as they are; marking the file as upgraded keeps older code away from it
+            self.connection.execute("UPDATE meta SET value = ? WHERE key = 'version'", (SNAPSHOT_VERSION,))
+        self.connection.commit()
+        self.path = path
+        self.resident = resident
+        self.sections = {}
+        self.dirty = set()
+
+    # Returns the named section, or the default if it has never been saved.
+    def load(self, name, default=None):
+        if name in self.sections:
+            return self.sections[name]
+        row = self.connection.execute("SELECT data FROM sections WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return default
+        value = pickle.loads(row[0])
+        if isinstance(value, External):
+            value = value.kind.load(value.path(self.path, name))
+        if self.resident:
+            self.sections[name] = value
+        return value
+
+    # Returns how many times the named section has been written to disk.
+    def generation(self, name):
+        row = self.connection.execute("SELECT generation FROM sections WHERE name = ?", (name,)).fetchone()
+        return row[0] if row is not None else 0
+
+    # Writes the given sections, all or nothing - or, for a resident snapshot, holds on to them until the next
+    # checkpoint.
+    def save(self, **sections):
+        if self.resident:
+            self.sections.update(sections)
+            self.dirty.update(sections)
+        else:
+            self.write(self.serialize(sections))
+
+    # Pickles the given sections, or dumps them to the file for their next generation if they're external. This is the
+    # part of a checkpoint that needs the state to hold still.
+    def serialize(self, sections):
+        blobs = {}
+        for name, value in sections.items():
+            if hasattr(value, "dump") and hasattr(type(value), "load"):
+                generation = self.generation(name) + 1
+                external = External(type(value), f"{name}.{generation}", generation)
+                value.dump(external.path(self.path, name))
+                blobs[name] = external
+            else:
+                blobs[name] = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        return blobs
+
+    # Writes already serialized sections to disk in a single transaction. External sections' new files take over once
+    # it commits, and the files they replace are removed then.
+    def write(self, blobs):
+        replaced = []
+        with self.connection:
+            for name, blob in blobs.items():
+                generation = self.generation(name) + 1
+                if isinstance(blob, External):
+                    row = self.connection.execute("SELECT data FROM sections WHERE name = ?", (name,)).fetchone()
+                    previous = pickle.loads(row[0]) if row is not None else None
+                    if isinstance(previous, External):
+                        replaced.append(previous.path(self.path, name))
+                    generation = blob.generation
+                    blob = pickle.dumps(blob, protocol=pickle.HIGHEST_PROTOCOL)
+                self.connection.execute("INSERT OR REPLACE INTO sections VALUES (?, ?, ?)", (name, generation, blob))
+        for path in replaced:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    # Writes every dirty section of a resident snapshot to disk, and returns how many there were.
+    def checkpoint(self):
+        blobs = self.serialize({name: self.sections[name] for name in self.dirty})
+        self.dirty.clear()
+        self.write(blobs)
+        return len(blobs)
+
+    def close(self):
+        self.connection.close()
+
+
+# Cold storage for whatever has fallen below the finality horizon: blocks that can no longer be reorged, along with
+# whether they ended up canonical, and the forks that were resolved before them. A normal cycle only ever writes to it;
+# everything in here is read on demand.
+class Archive:
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS blocks (hash TEXT PRIMARY KEY, parent TEXT, "
+                                "height INTEGER, timestamp INTEGER, canon INTEGER)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS blocks_by_height ON blocks (height)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS forks (id TEXT PRIMARY KEY, last_updated INTEGER, "
+                                "data TEXT)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS forks_by_update ON forks (last_updated)")
+        self.connection.commit()
+
+    # Stores (hash, parent, height, timestamp, canon) rows and a dict of staged forks by ID, in a single transaction.
+    def store(self, blocks=(), forks=None):
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO blocks VALUES (?, ?, ?, ?, ?)", blocks)
+            self.connection.executemany("INSERT OR REPLACE INTO forks VALUES (?, ?, ?)",
+                                        ((fork_hash, fork["last_updated"], json.dumps(fork))
+                                         for fork_hash, fork in (forks or {}).items()))
+
+    # Returns an archived block as a dict, or None if it isn't in the archive.
+    def block(self, blockhash):
+        row = self.connection.execute("SELECT hash, parent, height, timestamp, canon FROM blocks WHERE hash = ?",
+                                      (blockhash,)).fetchone()
+        if row is None:
+            return None
+        return {"hash": row[0], "parent": row[1], "height": row[2], "timestamp": row[3], "canon": bool(row[4])}
+
+    # Returns the hash of the archived canonical block at the given height, or None if there isn't one.
+    def canonical(self, height):
+        row = self.connection.execute("SELECT hash FROM blocks WHERE height = ? AND canon = 1", (height,)).fetchone()
+        return row[0] if row is not None else None
+
+    # Returns an archived fork by its ID, in the same layout it was staged in, or None if it isn't in the archive.
+    def fork(self, fork_hash):
+        row = self.connection.execute("SELECT data FROM forks WHERE id = ?", (fork_hash,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    # Yields (ID, fork) for every archived fork last updated at or after the given timestamp, oldest first.
+    def forks(self, since=0):
+        for row in self.connection.execute("SELECT id, data FROM forks WHERE last_updated >= ? ORDER BY last_updated",
+                                           (since,)):
+            yield row[0], json.loads(row[1])
+
+    # Yields (row, ID, fork) for every fork archived after the given row, in the order they were written. A fork that is
+    # archived again gets a new row, so following the last row seen picks up every change.
+    def added(self, after=0):
+        for row in self.connection.execute("SELECT rowid, id, data FROM forks WHERE rowid > ? ORDER BY rowid",
+                                           (after,)):
+            yield row[0], row[1], json.loads(row[2])
+
+    def close(self):
+        self.connection.close()
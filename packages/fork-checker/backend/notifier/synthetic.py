@@ -0,0 +1,102 @@
+# Generator for synthetic block files, shaped like the precomputed blocks in the mainnet bucket, so the notifier can be
+# exercised (and benchmarked) without downloading the real thing.
+# Usage: python synthetic.py DIRECTORY [--length N] [--fork-rate P] [--fork-depth N] [--supercharge P] [--size KB]
+
+# Imports
+import argparse
+import json
+import os
+import random
+
+ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+GENESIS_TIME = 1615939200000
+SLOT_TIME = 180000
+
+
+def base58(length, generator):
+    return "".join(generator.choice(ALPHABET) for _ in range(length))
+
+
+# Returns a pruned-to-the-essentials block, in the same layout as a precomputed block. The proof and the staged ledger
+# diff are padded out with 'padding' so files can be made about as big as the real ones.
+def block(previous_state_hash, slot, creator, charged, padding=""):
+    return {
+        "scheduled_time": str(GENESIS_TIME + slot * SLOT_TIME),
+        "protocol_state": {
+            "previous_state_hash": previous_state_hash,
+            "body": {
+                "consensus_state": {
+                    "block_creator": creator,
+                    "global_slot_since_genesis": str(slot),
+                    "supercharge_coinbase": charged
+                }
+            }
+        },
+        "protocol_state_proof": padding[:len(padding) // 8],
+        "staged_ledger_diff": {"diff": [{"commands": padding}]}
+    }
+
+
+# Yields (state hash, block) pairs for a chain of 'length' canonical blocks, in the order they'd arrive.
+# After each canonical block, a fork is started with probability 'fork_rate'. It branches off up to 'fork_depth' blocks
+# back, and grows by up to 'fork_depth' blocks, but never reaches past the canonical tip, so it always stays a fork.
+# 'supercharge' is the fraction of blocks with a supercharged coinbase.
+def chain(length, fork_rate=0.05, fork_depth=3, supercharge=0.5, producers=200, seed=0, padding=""):
+    generator = random.Random(seed)
+    creators = ["B62q" + base58(51, generator) for _ in range(producers)]
+    canonical = [("3N" + base58(50, generator), 0)]  # Stands in for genesis, which isn't in the bucket either
+    for _ in range(length):
+        parent, slot = canonical[-1]
+        # Mainnet fills roughly three slots in four, so leave the odd gap
+        slot += 1 + (generator.random() < 0.25)
+        state_hash = "3N" + base58(50, generator)
+        canonical.append((state_hash, slot))
+        yield state_hash, block(parent, slot, generator.choice(creators), generator.random() < supercharge, padding)
+
+        if generator.random() < fork_rate and len(canonical) > 2:
+            back = generator.randint(1, min(fork_depth, len(canonical) - 2))
+            fork_parent, fork_slot = canonical[-1 - back]
+            for _ in range(generator.randint(1, fork_depth)):
+                fork_slot += 1
+                if fork_slot > slot:
+                    break
+                fork_hash = "3N" + base58(50, generator)
+                yield fork_hash, block(fork_parent, fork_slot, generator.choice(creators),
+                                       generator.random() < supercharge, padding)
+                fork_parent = fork_hash
+
+
+# Writes the given (state hash, block) pairs to the directory using the bucket's naming scheme, and returns the paths.
+def write(directory, blocks):
+    os.makedirs(directory, exist_ok=True)
+    files = []
+    for state_hash, contents in blocks:
+        file = os.path.join(directory, f"mainnet-{state_hash}.json")
+        with open(file, "w", encoding="ISO-8859-1") as block_file:
+            json.dump(contents, block_file)
+        files.append(file)
+    return files
+
+
+# Pads blocks out to roughly 'size' KB each.
+def padding(size, seed=0):
+    return base58(1024, random.Random(seed)) * size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic chain of block files.")
+    parser.add_argument("directory")
+    parser.add_argument("--length", type=int, default=10000, help="number of canonical blocks")
+    parser.add_argument("--fork-rate", type=float, default=0.05, help="chance of a fork after each canonical block")
+    parser.add_argument("--fork-depth", type=int, default=3, help="maximum depth and length of a fork")
+    parser.add_argument("--supercharge", type=float, default=0.5, help="fraction of supercharged blocks")
+    parser.add_argument("--size", type=int, default=0, help="approximate padding per block, in KB")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    files = write(args.directory, chain(args.length, args.fork_rate, args.fork_depth, args.supercharge,
+                                        seed=args.seed, padding=padding(args.size, args.seed)))
+    print(f"Wrote {len(files)} blocks to {args.directory}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+# Tests for the read API, served from the state a pipeline left behind.
+
+# Imports
+from conftest import arrivals
+from http.server import ThreadingHTTPServer
+import api
+import json
+import pytest
+import threading
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+
+# Serves the API over whatever the pipeline has staged so far, and returns a function that GETs a path from it as
+# (status, JSON body, headers).
+@pytest.fixture
+def served(pipeline, monkeypatch):
+    pipeline.feed(arrivals(400, window=20, fork_rate=0.3, fork_depth=4, seed=2), 100)
+    source = api.ForkSource()
+    source.refresh()
+    monkeypatch.setattr(api.Handler, "source", source)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), api.Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def get(path):
+        try:
+            with urlopen(f"http://127.0.0.1:{server.server_port}{path}") as response:
+                return response.status, json.loads(response.read()), response.headers
+        except HTTPError as error:
+            return error.code, json.loads(error.read()), error.headers
+    yield get
+    server.shutdown()
+    server.server_close()
+
+
+def test_pages_cover_every_fork(served):
+    status, everything, headers = served("/forks")
+    assert status == 200 and len(everything) > 5 and "Link" not in headers
+    paged = []
+    path = "/forks?limit=2&summary=1"
+    while path:
+        status, page, headers = served(path)
+        assert status == 200 and len(page) <= 2
+        paged.extend(page)
+        path = headers.get("Link", "")[1:].partition(">")[0]
+    assert [fork["id"] for fork in paged] == [fork["id"] for fork in everything]
+
+
+@pytest.mark.parametrize("limit", ["0", "-1", "-1000", "many"])
+def test_bad_limits_are_rejected(served, limit):
+    status, body, headers = served(f"/forks?limit={limit}")
+    assert status == 400 and "limit" in body["error"]
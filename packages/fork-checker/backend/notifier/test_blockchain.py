@@ -0,0 +1,228 @@
+# Tests for the Blockchain's indexes, checked against brute-force answers worked out from the blocks themselves.
+
+# Imports
+from conftest import arrivals
+import notifier
+import pickle
+import random
+
+
+def block_of(state_hash, record):
+    return notifier.Block(state_hash, record["protocol_state"]["previous_state_hash"],
+                          record["protocol_state"]["body"]["consensus_state"]["global_slot_since_genesis"],
+                          record["scheduled_time"])
+
+
+# Builds a chain from the given (state hash, record) pairs, in order, and returns it with the Blocks added.
+def build(pairs):
+    blockchain = notifier.Blockchain()
+    blocks = [block_of(state_hash, record) for state_hash, record in pairs]
+    for block in blocks:
+        blockchain.add(block)
+    return blockchain, blocks
+
+
+# Checks every index against the given blocks, which should be exactly the ones in the chain, in the order they arrived.
+# The tip is the first of the highest blocks to arrive; once it's been removed, any of the highest will do.
+def check(blockchain, blocks, first_seen=True):
+    present = {block.hash: block for block in blocks}
+    children = {}
+    for block in blocks:
+        children.setdefault(block.parent, set()).add(block.hash)
+    assert len(blockchain.blocks) == len(blocks)
+    for block in blocks:
+        assert blockchain.has(block.hash)
+        assert blockchain.successors(block.hash) == children.get(block.hash, set())
+        rivals = [other.hash for other in blocks if int(other.height) == int(block.height) and other is not block]
+        assert blockchain.rivals(block.hash, block.height) == rivals
+    endpoints = {block.hash for block in blocks if not children.get(block.hash)}
+    assert {block.hash for block in blockchain.endpoints()} == endpoints
+    orphans = {block.hash for block in blocks if block.parent not in present}
+    assert {blockchain.hashes[i] for i in blockchain.orphans} == orphans
+    # The highest block by height then timestamp, the first to arrive winning ties
+    tip = None
+    for block in blocks:
+        if tip is None or (int(block.height), int(block.timestamp)) > (int(tip.height), int(tip.timestamp)):
+            tip = block
+    if first_seen:
+        assert blockchain.canonical().hash == tip.hash
+    else:
+        assert blockchain.tip_rank == (int(tip.height), int(tip.timestamp))
+
+
+def test_indexes_in_order():
+    blockchain, blocks = build(arrivals(400, fork_rate=0.3, fork_depth=4))
+    check(blockchain, blocks)
+
+
+def test_indexes_with_children_before_parents():
+    blockchain, blocks = build(arrivals(400, window=30, fork_rate=0.3, fork_depth=4, seed=3))
+    check(blockchain, blocks)
+
+
+def test_indexes_after_removals():
+    blockchain, blocks = build(arrivals(400, window=30, fork_rate=0.3, fork_depth=4, seed=5))
+    generator = random.Random(5)
+    removed = generator.sample(blocks, 60)
+    # The tip goes too, so a new one has to be found among the endpoints
+    removed.append(next(block for block in blocks if block.hash == blockchain.tip))
+    for block in removed:
+        if blockchain.has(block.hash):
+            blockchain.remove(block)
+    blocks = [block for block in blocks if block not in removed]
+    check(blockchain, blocks, first_seen=False)
+    # Adding them back reuses their ids and ends up where the chain would have been without the removals
+    for block in removed:
+        if not blockchain.has(block.hash):
+            blockchain.add(block)
+            blocks.append(block)
+    check(blockchain, blocks, first_seen=False)
+
+
+def test_adding_a_block_again_replaces_it():
+    blockchain, blocks = build(arrivals(100, fork_rate=0.3))
+    again = blocks[::7]
+    for block in again:
+        blockchain.add(block)
+    # Same blocks, only the re-added ones now count as having arrived last
+    check(blockchain, [block for block in blocks if block not in again] + again, first_seen=False)
+
+
+# Every column and index of the two chains, as plain values, so they can be compared whatever they're backed by.
+def columns(blockchain):
+    state = {name: list(getattr(blockchain, name)) for name in notifier.CHAIN_COLUMNS + ("slot_first",)}
+    state.update(hashes=list(blockchain.hashes), canons=bytes(blockchain.canons), present=bytes(blockchain.present),
+                 ids={blockhash: blockchain.ids.get(blockhash) for blockhash in blockchain.hashes},
+                 resolved=(list(blockchain.resolved.timestamps), list(blockchain.resolved.hashes)),
+                 tips=blockchain.tips, orphans=blockchain.orphans, archived=blockchain.archived, count=blockchain.count,
+                 cursor=blockchain.cursor, tip=blockchain.tip, tip_rank=blockchain.tip_rank, painted=blockchain.painted)
+    return state
+
+
+def test_dump_and_load(pipeline, tmp_path, monkeypatch):
+    # A short finality gets blocks archived, so the chain has archived parents and a resolved index that doesn't start
+    # at the bottom
+    monkeypatch.setenv("FINALITY", "40")
+    pipeline.feed(arrivals(500, window=20, fork_rate=0.3, fork_depth=4, seed=9), 50)
+    blockchain = pipeline.snapshot().load("blockchain")
+    assert blockchain.archived and blockchain.painted
+    blockchain.dump(tmp_path / "chain")
+    loaded = notifier.Blockchain.load(tmp_path / "chain")
+    assert loaded.mapped is not None
+    assert columns(loaded) == columns(blockchain)
+    blocks = [notifier.Blockchain.copy(block) for block in blockchain.blocks.values()]
+    assert {block.hash: block.canon for block in loaded.blocks.values()} == \
+        {block.hash: block.canon for block in blocks}
+    for block in blocks:
+        assert loaded.successors(block.hash) == blockchain.successors(block.hash)
+        assert loaded.rivals(block.hash, block.height) == blockchain.rivals(block.hash, block.height)
+        assert loaded.resolved.successor(int(block.timestamp)) == blockchain.resolved.successor(int(block.timestamp))
+
+    # Once changed, a loaded chain carries on exactly as the one it was dumped from
+    more = [block_of(state_hash, record) for state_hash, record in arrivals(520, fork_rate=0.3, fork_depth=4, seed=9)]
+    more = [block for block in more if not blockchain.has(block.hash)][:40]
+    for chain in (blockchain, loaded):
+        chain.remove(blocks[-1])
+        for block in more:
+            chain.add(block)
+    assert loaded.mapped is None
+    assert columns(loaded) == columns(blockchain)
+
+
+# Marks the chain from the tip back as canonical, the way paint() would.
+def paint(blockchain):
+    block = blockchain.canonical()
+    while block is not None:
+        block.canon = True
+        blockchain.resolved.add(int(block.timestamp), block.hash)
+        block = blockchain.get(block.parent)
+
+
+def test_finalize():
+    blockchain, blocks = build(arrivals(600, window=30, fork_rate=0.3, fork_depth=4, seed=13))
+    paint(blockchain)
+    canon = {block.hash for block in blockchain.blocks.values() if block.canon}
+    horizon = int(blockchain.canonical().height) - 50
+    final = blockchain.finalize(horizon)
+    finalized = {block.hash for block in final}
+    assert len(finalized) == len(final) and {block.canon for block in final} == {True, False}
+    # The chain gets rebuilt, but what's left keeps the order it arrived in
+    remaining = [block for block in blocks if block.hash not in finalized]
+    check(blockchain, remaining, first_seen=False)
+    for block in final:
+        assert int(block.height) < horizon
+    # Forks that got past the horizon keep everything back to the canonical block they branched off from
+    for tip in blockchain.endpoints():
+        block = tip
+        while block is not None and not block.canon:
+            block = blockchain.get(block.parent)
+        if int(tip.height) >= horizon:
+            assert block is not None
+    assert set(blockchain.resolved.hashes) == canon - finalized
+    # Only archived parents that something left in the chain still points to are remembered
+    assert blockchain.archived == {block.parent for block in remaining} & finalized
+
+    # Finalizing again right away has nothing left to take
+    assert blockchain.finalize(horizon) == []
+
+
+def test_pickles():
+    blockchain, blocks = build(arrivals(300, window=10, fork_rate=0.3, seed=17))
+    paint(blockchain)
+    blockchain.cursor = 300
+    assert columns(pickle.loads(pickle.dumps(blockchain))) == columns(blockchain)
+    # Pickles from before the columnar layout hold Block objects, which are added again on the way in
+    legacy = pickle.loads(pickle.dumps({"blocks": {block.hash: block for block in blocks}, "cursor": 300}))
+    unpickled = notifier.Blockchain.__new__(notifier.Blockchain)
+    unpickled.__setstate__(legacy)
+    check(unpickled, blocks)
+    assert unpickled.cursor == 300 and unpickled.painted is None
+
+
+def test_slot_index_spans_only_the_chain(tmp_path):
+    # A chain that is young in blocks but old in slots, as the hot chain always is after archiving
+    far = 1000000
+    blockchain = notifier.Blockchain()
+    blocks = []
+    for state_hash, record in arrivals(400, window=20, fork_rate=0.3, seed=19):
+        block = block_of(state_hash, record)
+        block.height = int(block.height) + far
+        blockchain.add(block)
+        blocks.append(block)
+    check(blockchain, blocks)
+    span = max(int(block.height) for block in blocks) - min(int(block.height) for block in blocks) + 1
+    assert blockchain.slot_base == far + 1 and len(blockchain.slot_first) == span
+    paint(blockchain)
+    final = {block.hash for block in blockchain.finalize(far + 400)}
+    remaining = [block for block in blocks if block.hash not in final]
+    check(blockchain, remaining, first_seen=False)
+    assert blockchain.slot_base == min(int(block.height) for block in remaining)
+    # Neither the file nor the slot index grows with how far along the slots are
+    blockchain.dump(tmp_path / "chain")
+    assert (tmp_path / "chain").stat().st_size < 200 * len(blockchain.hashes)
+    loaded = notifier.Blockchain.load(tmp_path / "chain")
+    assert columns(loaded) == columns(blockchain) and loaded.slot_base == blockchain.slot_base
+    check(loaded, remaining, first_seen=False)
+    # A block from before the start of the index moves the start back
+    early = notifier.Block("3NKearly", blocks[0].hash, far - 5, 1)
+    loaded.add(early)
+    assert loaded.slot_base == far - 5 and loaded.rivals(None, far - 5) == [early.hash]
+    check(loaded, remaining + [early], first_seen=False)
+
+
+def test_loads_chain_files_without_a_slot_base(tmp_path):
+    # Older files always indexed slots from 0, so the chain has to start there too
+    blockchain, blocks = build(arrivals(100, fork_rate=0.3, seed=23))
+    genesis = notifier.Block("3NKgenesis", "3NKnone", 0, 0)
+    blockchain.add(genesis)
+    blocks.append(genesis)
+    assert blockchain.slot_base == 0
+    blockchain.dump(tmp_path / "chain")
+    # The same file as it was written before the header had the slot base in it
+    contents = (tmp_path / "chain").read_bytes()
+    fields = notifier.CHAIN_HEADER.unpack_from(contents)
+    legacy = notifier.LEGACY_CHAIN_HEADER.pack(notifier.LEGACY_CHAIN_MAGIC, *fields[1:-1])
+    (tmp_path / "legacy").write_bytes(legacy + contents[notifier.CHAIN_HEADER.size:])
+    loaded = notifier.Blockchain.load(tmp_path / "legacy")
+    assert loaded.slot_base == 0 and columns(loaded) == columns(blockchain)
+    check(loaded, blocks)
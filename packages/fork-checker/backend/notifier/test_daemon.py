@@ -0,0 +1,50 @@
+# Tests for how the daemon's cycles and checkpoints share the resident state.
+
+# Imports
+from daemon import Daemon
+from networks import Network
+import notifier
+import pytest
+import threading
+
+
+# A daemon, and the same for a network run by the scheduler, with the pipeline left out of their cycles; only the order
+# things happen in is recorded.
+@pytest.fixture(params=["daemon", "network"])
+def daemon(request, pipeline, monkeypatch):
+    happened = []
+    monkeypatch.setattr(notifier, "powercycle", lambda printout=False: happened.append("cycle"))
+    instance = Daemon(printout=False) if request.param == "daemon" else Network("devnet", printout=False)
+    instance.happened = happened
+    return instance
+
+
+def test_a_tick_during_a_checkpoint_waits_for_it(daemon, monkeypatch):
+    pickling = threading.Event()
+    finish = threading.Event()
+    serialize = daemon.snapshot.serialize
+
+    # The checkpoint holds on to the state until told to let go
+    def slow(sections):
+        pickling.set()
+        finish.wait(10)
+        daemon.happened.append("checkpoint")
+        return serialize(sections)
+    monkeypatch.setattr(daemon.snapshot, "serialize", slow)
+    daemon.snapshot.save(contested={"3NKblock"})
+    checkpoint = threading.Thread(target=daemon.checkpoint)
+    tick = threading.Thread(target=daemon.cycle)
+    checkpoint.start()
+    try:
+        assert pickling.wait(10)
+        tick.start()
+        tick.join(0.2)
+        assert tick.is_alive() and daemon.happened == []
+    finally:
+        # Either way, both are done with the state before the test's directory goes
+        finish.set()
+        checkpoint.join(10)
+        if tick.is_alive():
+            tick.join(10)
+    assert daemon.happened == ["checkpoint", "cycle"]
+    assert daemon.cycles == 1 and daemon.skipped == 0
@@ -0,0 +1,54 @@
+# Tests for incremental painting: after every cycle, the canon flags, the resolved index and the events reported so far
+# should all agree with a brute-force walk back from the tip.
+
+# Imports
+from conftest import arrivals
+import notifier
+
+
+# The hashes of every block from the tip back to the first one whose parent is missing.
+def canonical_walk(blockchain):
+    found = set()
+    block = blockchain.canonical()
+    while block is not None:
+        found.add(block.hash)
+        block = blockchain.get(block.parent)
+    return found
+
+
+# Adds the blocks in batches, taking each through download, parse, blockmap and paint, and checks the painted chain
+# after every one. Returns the number of reorgs seen.
+def paint_all(pipeline, blocks, batch):
+    canon = set()
+    reorgs = 0
+    for start in range(0, len(blocks), batch):
+        pipeline.add(blocks[start:start + batch])
+        master, _ = notifier.parse(notifier.download())
+        blockchain = notifier.blockmap(master)
+        event = notifier.paint(blockchain)
+        expected = canonical_walk(blockchain)
+        assert {block.hash for block in blockchain.blocks.values() if block.canon} == expected
+        assert set(blockchain.resolved.hashes) == expected
+        assert list(blockchain.resolved.timestamps) == sorted(blockchain.resolved.timestamps)
+        if event is not None:
+            assert event["tip"] == blockchain.tip
+            # Events describe the change from the chain painted before, so replaying them has to land on this one
+            assert set(event["orphaned"]) <= canon
+            assert not set(event["canonical"]) & canon
+            canon = (canon - set(event["orphaned"])) | set(event["canonical"])
+            reorgs += bool(event["orphaned"])
+        assert canon == expected
+    return reorgs
+
+
+def test_paint_in_order(pipeline):
+    paint_all(pipeline, arrivals(600, fork_rate=0.3, fork_depth=4), 37)
+
+
+def test_paint_through_reorgs(pipeline):
+    # Shuffled arrivals make forks briefly the highest, and leave gaps that are only filled in later
+    assert paint_all(pipeline, arrivals(1500, window=20, fork_rate=0.3, fork_depth=5, seed=7), 37) > 0
+
+
+def test_paint_one_block_at_a_time(pipeline):
+    assert paint_all(pipeline, arrivals(200, window=8, fork_rate=0.4, fork_depth=3, seed=11), 1) > 0
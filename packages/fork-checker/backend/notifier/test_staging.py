@@ -0,0 +1,99 @@
+# Tests for staging forks and uploading them, run against shuffled synthetic chains.
+
+# Imports
+from conftest import arrivals, Pipeline
+from store import Archive
+import notifier
+
+
+# What staging left behind, in the order it was left in: the staged forks, their segments, what's yet to be sent, and
+# every update sent.
+def staged(pipeline):
+    state = pipeline.snapshot()
+    return (list(state.load("staged").items()), list(state.load("segments").items()),
+            sorted(state.load("unsent") or ()), sorted(state.load("unsent_segments") or ()), pipeline.backend.updates)
+
+
+def test_parallel_staging_matches_serial(pipeline, tmp_path, monkeypatch):
+    # Every cycle has enough segments to go to the workers
+    monkeypatch.setattr(notifier, "PARALLEL_STAGING_MIN", 4)
+    pooled = notifier.pooled
+    calls = []
+
+    def spy(function, items, workers):
+        calls.append(getattr(function, "func", function).__name__)
+        return pooled(function, items, workers)
+    monkeypatch.setattr(notifier, "pooled", spy)
+    blocks = arrivals(1200, window=20, fork_rate=0.4, fork_depth=6, seed=21)
+    results = {}
+    for workers in ("1", "2"):
+        directory = tmp_path / f"workers-{workers}"
+        directory.mkdir()
+        monkeypatch.chdir(directory)
+        monkeypatch.setenv("BUCKET_NAME", str(directory / "bucket"))
+        monkeypatch.setenv("OUTPUT_DIR", str(directory / "blocks"))
+        monkeypatch.setenv("STAGE_WORKERS", workers)
+        run = Pipeline(str(directory))
+        run.feed(blocks[:600], 600)
+        run.feed(blocks[600:], 50)
+        results[workers] = staged(run)
+    assert results["1"][0] and "build_segment_batch" in calls
+    assert results["1"] == results["2"]
+
+
+def test_forks_resolve_once_the_canonical_chain_gets_past_them(pipeline, monkeypatch):
+    monkeypatch.setenv("FINALITY", "60")
+    # Forks whose heads arrive before any canonical block after them get staged unresolved at first
+    pipeline.feed(arrivals(1500, window=20, fork_rate=0.3, fork_depth=5, seed=7), 37)
+    blockchain = pipeline.snapshot().load("blockchain")
+    tip = int(blockchain.canonical().timestamp)
+    cold = Archive("archive.sqlite")
+    uploaded = pipeline.backend.data
+    forks = {fork_hash: cold.fork(fork_hash) for fork_hash in uploaded if cold.fork(fork_hash) is not None}
+    forks.update((fork_hash, notifier.expand(fork, pipeline.snapshot().load("segments")))
+                 for fork_hash, fork in pipeline.snapshot().load("staged").items())
+    cold.close()
+    assert len(forks) == len(uploaded)
+    assert any(not fork["resolved_at"] for update in pipeline.backend.updates for fork in update.values())
+    for fork_hash, fork in forks.items():
+        # Resolved whenever a canonical block came after the head, which the canonical tip will have if any did
+        assert bool(fork["resolved_at"]) == (fork["blocks"]["timestamp"][-1] < tip)
+        assert uploaded[fork_hash]["resolved_at"] == fork["resolved_at"]
+
+
+def test_alertable_blocks_follow_late_rivals(pipeline):
+    blocks = arrivals(1200, window=20, fork_rate=0.4, fork_depth=5, seed=5)
+    pipeline.feed(blocks[:100], 100)
+    # Rivals turning up after the blocks they rival have been staged change what was sent for those before
+    first = {}
+    for start in range(100, len(blocks), 25):
+        pipeline.feed(blocks[start:start + 25], 25)
+        for update in pipeline.backend.updates:
+            for fork_hash, fork in update.items():
+                first.setdefault(fork_hash, fork)
+    state = pipeline.snapshot()
+    blockchain = state.load("blockchain")
+    segments = state.load("segments")
+    uploaded = pipeline.backend.data
+    changed = 0
+    for fork_hash, fork in state.load("staged").items():
+        expected = notifier.expand(fork, segments)
+        assert uploaded[fork_hash] == expected
+        for block, rivals in zip(expected["blocks"]["block"], expected["blocks"]["alertable"]):
+            if blockchain.has(block):
+                assert rivals == blockchain.rivals(block, blockchain.get(block).height)
+        changed += first[fork_hash]["blocks"]["alertable"] != expected["blocks"]["alertable"]
+    assert changed
+    assert not state.load("contested")
+
+
+def test_idle_cycles_write_nothing(pipeline):
+    blocks = arrivals(300, window=20, fork_rate=0.3, seed=4)
+    pipeline.feed(blocks, 100)
+    state = pipeline.snapshot()
+    assert state.load("unsent") == set()
+    generations = {name: state.generation(name) for name in ("blockchain", "staged", "segments", "latest", "unsent",
+                                                               "unsent_segments", "statistics", "contested")}
+    result = pipeline.run()
+    assert result["new_blocks"] == 0 and result["uploaded_forks"] == 0
+    assert {name: state.generation(name) for name in generations} == generations
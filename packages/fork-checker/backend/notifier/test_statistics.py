@@ -0,0 +1,68 @@
+# Tests for the producer and epoch statistics, checked against a full recount of every block stored so far.
+
+# Imports
+from conftest import arrivals
+from store import Archive, BlockStore
+import notifier
+import os
+
+
+# Counts every block in the store from scratch, by whether it's canonical now (in the chain or, once archived, in the
+# archive). Returns the producers' and epochs' totals, laid out like Statistics keeps them.
+def recount():
+    master = BlockStore(os.path.abspath("blocks.sqlite"))
+    blockchain = notifier.snapshot().load("blockchain")
+    cold = Archive("archive.sqlite")
+    producers, epochs, slots = {}, {}, {}
+    for position, block_hash, record in master.since(0):
+        block = blockchain.get(block_hash)
+        canon = block.canon if block is not None else cold.block(block_hash)["canon"]
+        consensus = record["protocol_state"]["body"]["consensus_state"]
+        creator, slot = consensus["block_creator"], int(consensus["global_slot_since_genesis"])
+        slots.setdefault(slot, []).append((creator, canon))
+        for key, totals in ((creator, producers), (slot // notifier.SLOTS_PER_EPOCH, epochs)):
+            counts = totals.setdefault(key, [0] * len(notifier.STATISTICS_FIELDS))
+            counts[0] += 1
+            if not canon:
+                counts[1] += 1
+                counts[2] += notifier.coinbase(record)
+    for slot, blocks in slots.items():
+        if len(blocks) > 1:
+            for creator, canon in blocks:
+                for key, totals in ((creator, producers), (slot // notifier.SLOTS_PER_EPOCH, epochs)):
+                    totals[key][3 if canon else 4] += 1
+    cold.close()
+    return producers, epochs
+
+
+def test_statistics_follow_reorgs(pipeline, monkeypatch):
+    monkeypatch.setenv("FINALITY", "60")
+    blocks = arrivals(1500, window=20, fork_rate=0.3, fork_depth=5, seed=7)
+    pipeline.feed(blocks[:500], 500)
+    for start in range(500, len(blocks), 37):
+        pipeline.feed(blocks[start:start + 37], 37)
+        statistics = pipeline.snapshot().load("statistics")
+        assert (statistics.producers, statistics.epochs) == recount()
+    # Battles are only remembered while their slot can still change
+    blockchain = pipeline.snapshot().load("blockchain")
+    assert all(blockchain.rivals(None, slot) for slot in statistics.battles)
+
+
+def test_statistics_recounted_after_a_missed_event(pipeline):
+    blocks = arrivals(600, window=20, fork_rate=0.3, fork_depth=5, seed=3)
+    pipeline.feed(blocks[:500], 100)
+    # As if the last cycle had stopped between painting and tallying
+    state = pipeline.snapshot()
+    statistics = state.load("statistics")
+    statistics.painted = "3NLmissed"
+    state.save(statistics=statistics)
+    pipeline.feed(blocks[500:], 100)
+    statistics = pipeline.snapshot().load("statistics")
+    producers, epochs = recount()
+    # Blocks archived by then are counted from the archive, but the battles they were in can't be, so those come out
+    # short. Everything else comes out the same
+    for totals, expected in ((statistics.producers, producers), (statistics.epochs, epochs)):
+        assert totals.keys() == expected.keys()
+        for key, counts in totals.items():
+            assert counts[:3] == expected[key][:3]
+            assert counts[3] <= expected[key][3] and counts[4] <= expected[key][4]
@@ -0,0 +1,66 @@
+# Tests for the snapshot's sections, external ones (kept in files of their own) included.
+
+# Imports
+from conftest import arrivals
+from store import External, Snapshot
+from test_blockchain import build, columns
+import os
+import pickle
+import pytest
+import sqlite3
+
+
+# Stands in for the snapshot's connection, but fails the moment the given section is written, as if the process had
+# died right there.
+class Failing:
+    def __init__(self, connection, section):
+        self.connection = connection
+        self.section = section
+
+    def execute(self, statement, parameters=()):
+        if statement.startswith("INSERT") and parameters[0] == self.section:
+            raise sqlite3.OperationalError("Stopped")
+        return self.connection.execute(statement, parameters)
+
+    def __enter__(self):
+        return self.connection.__enter__()
+
+    def __exit__(self, *details):
+        return self.connection.__exit__(*details)
+
+
+def test_external_sections_commit_with_the_rest(tmp_path):
+    path = str(tmp_path / "snapshot.sqlite")
+    old, _ = build(arrivals(100, fork_rate=0.3, seed=1))
+    new, _ = build(arrivals(150, fork_rate=0.3, seed=1))
+    snapshot = Snapshot(path)
+    snapshot.save(blockchain=old, contested={"3NKold"})
+    # The chain file is written, but the transaction recording it never commits
+    snapshot.connection = Failing(snapshot.connection, "contested")
+    with pytest.raises(sqlite3.OperationalError):
+        snapshot.save(blockchain=new, contested={"3NKnew"})
+    snapshot = Snapshot(path)
+    assert columns(snapshot.load("blockchain")) == columns(old)
+    assert snapshot.load("contested") == {"3NKold"}
+    assert snapshot.generation("blockchain") == 1
+
+    # Trying again takes over the file the failed attempt left, and the old one goes
+    snapshot.save(blockchain=new, contested={"3NKnew"})
+    snapshot = Snapshot(path)
+    assert columns(snapshot.load("blockchain")) == columns(new)
+    assert snapshot.load("contested") == {"3NKnew"}
+    assert sorted(os.listdir(tmp_path)) == ["snapshot.sqlite", "snapshot.sqlite.blockchain.2"]
+
+
+def test_external_sections_from_before_generations(tmp_path):
+    path = str(tmp_path / "snapshot.sqlite")
+    blockchain, _ = build(arrivals(100, fork_rate=0.3, seed=2))
+    snapshot = Snapshot(path)
+    # Laid out as before: the chain file named after the section alone, and a row that doesn't name it
+    blockchain.dump(f"{path}.blockchain")
+    legacy = pickle.dumps(External(type(blockchain)))
+    with snapshot.connection:
+        snapshot.connection.execute("INSERT INTO sections VALUES (?, ?, ?)", ("blockchain", 1, legacy))
+    assert columns(Snapshot(path).load("blockchain")) == columns(blockchain)
+    snapshot.save(blockchain=blockchain)
+    assert sorted(os.listdir(tmp_path)) == ["snapshot.sqlite", "snapshot.sqlite.blockchain.2"]
@@ -0,0 +1,269 @@
+# Watch mode: rather than waiting for the next cycle, every block file is taken through the pipeline as soon as it
+# lands in OUTPUT_DIR, so fork alerts go out within seconds of a block being produced.
+# Usage: python watch.py
+# New files are picked up through inotify where it's available (Linux), or by polling the directory every WATCH_POLL
+# seconds (default 0.5) otherwise. Uploads are batched up: they go out once nothing new has been staged for
+# WATCH_DEBOUNCE seconds (default 1), or WATCH_MAX_DELAY seconds (default 5) after the first unsent change, whichever
+# comes first. Blocks don't always land in order, so a file whose parent hasn't turned up yet is held back for up to
+# WATCH_GRACE seconds (default 30) in case it does. A background thread keeps OUTPUT_DIR in sync with the bucket every
+# WATCH_SYNC_INTERVAL seconds (default 60); set it to 0 when something else fills the directory - or to try it out by
+# dropping files into the directory.
+# CHECKPOINT_INTERVAL and METRICS_PORT work the same as for daemon.py.
+
+# Imports
+import ctypes
+import ctypes.util
+from daemon import Daemon
+import metrics
+import notifier
+import os
+import select
+import signal
+from store import BlockStore, Manifest
+import struct
+import threading
+import time
+import traceback
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_EVENT = struct.Struct("iIII")
+
+
+# Minimal inotify binding, through ctypes so there's nothing extra to install. Raises OSError where inotify isn't
+# available. Files count as new once they've been written and closed, or moved into the directory (which is how
+# synchronize() and gsutil both finish a file).
+class Inotify:
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f"Can't watch {directory}")
+
+    # Waits up to 'timeout' seconds for files to turn up, and returns their names - or None if events were dropped,
+    # in which case the directory has to be listed to be sure nothing was missed.
+    def read(self, timeout):
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        data = os.read(self.fd, 65536)
+        names = []
+        position = 0
+        while position < len(data):
+            _, mask, _, length = IN_EVENT.unpack_from(data, position)
+            position += IN_EVENT.size
+            if mask & IN_Q_OVERFLOW:
+                return None
+            names.append(os.fsdecode(data[position:position + length].rstrip(b"\0")))
+            position += length
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+# Returns the endpoints of every branch running through the given blocks.
+def heads(blockchain, hashes):
+    found = set()
+    seen = set()
+    stack = list(hashes)
+    while stack:
+        block_hash = stack.pop()
+        if block_hash in seen:
+            continue
+        seen.add(block_hash)
+        children = blockchain.successors(block_hash)
+        if not children and blockchain.has(block_hash):
+            found.add(blockchain.get(block_hash))
+        stack.extend(children)
+    return found
+
+
+# Keeps the same resident state, checkpoints and shutdown handling as the daemon, but is driven by new files instead of
+# a schedule. Each batch of files goes through parse, blockmap and paint as usual, then only the forks they (or a reorg
+# they caused) touched are processed and staged.
+class Watcher(Daemon):
+    def __init__(self, backend=None, poll=None, debounce=None, max_delay=None, sync_interval=None, printout=True):
+        super().__init__(printout=printout)
+        self.backend = backend
+        self.poll = poll or float(os.environ.get("WATCH_POLL", 0.5))
+        self.debounce = debounce or float(os.environ.get("WATCH_DEBOUNCE", 1))
+        self.max_delay = max_delay or float(os.environ.get("WATCH_MAX_DELAY", 5))
+        self.sync_interval = float(os.environ.get("WATCH_SYNC_INTERVAL", 60)) if sync_interval is None \
+            else sync_interval
+        self.output = os.environ.get("OUTPUT_DIR", "mina_mainnet_blocks")
+        self.grace = float(os.environ.get("WATCH_GRACE", 30))
+        self.manifest = Manifest(os.environ.get("MANIFEST", "manifest.sqlite"))
+        self.store = BlockStore(os.path.abspath(os.environ.get("STORE", "blocks.sqlite")))
+        # Files held back for their parent, with when they turned up and who the parent is
+        self.waiting = {}
+        # When the first change since the last upload was staged, and when the most recent one was
+        self.first_change = None
+        self.last_change = None
+        self.ingested = 0
+
+    # Takes the given files through the pipeline, up to and including staging. Returns the number of new blocks.
+    def ingest(self, files):
+        with self.lock:
+            notifier.resident = self.snapshot
+            with metrics.timed("ingest"):
+                master, new_files = notifier.parse(files)
+                metrics.NEW_BLOCKS.inc(new_files)
+                if not new_files:
+                    return 0
+                blockchain = notifier.blockmap(master)
+                event = notifier.paint(blockchain)
+                notifier.tally(blockchain, master, event)
+                # A reorg turns the old canonical branch into a fork, so it has to be looked at too
+                touched = [notifier.state_hash_of(file) for file in files]
+                if event and event["orphaned"]:
+                    touched.append(event["orphaned"][0])
+                forks = notifier.process(blockchain, heads(blockchain, touched))
+                notifier.prestage(forks, master, blockchain)
+            # Nothing tracked yet (None) means everything staged still has to go out
+            unsent = self.snapshot.load("unsent")
+            if unsent is None or unsent:
+                self.last_change = time.monotonic()
+                self.first_change = self.first_change or self.last_change
+        self.ingested += new_files
+        if self.printout:
+            print(f"Ingested {new_files} new Blocks, {len(forks)} Forks touched.")
+        return new_files
+
+    # Adds the given files to those waiting, and returns every waiting file that is ready to go: its parent is already
+    # stored or ready itself, or it has waited out the grace period. Taking in a child without its parent would stage it
+    # as a fork of its own.
+    def ready(self, files):
+        now = time.monotonic()
+        for file in files:
+            if file not in self.waiting:
+                try:
+                    parent = notifier.extract(file)[1]["protocol_state"]["previous_state_hash"]
+                except (OSError, ValueError, KeyError):
+                    parent = None  # Let parse() deal with it
+                self.waiting[file] = (now, parent)
+        ready = {}
+        changed = True
+        while changed:
+            changed = False
+            for file, (since, parent) in list(self.waiting.items()):
+                if parent is None or parent in ready or parent in self.store or now - since >= self.grace:
+                    ready[notifier.state_hash_of(file)] = file
+                    del self.waiting[file]
+                    changed = True
+        return list(ready.values())
+
+    # Returns how long until the pending changes are due to be uploaded, or None if there aren't any.
+    def due(self):
+        if self.first_change is None:
+            return None
+        now = time.monotonic()
+        return max(0, min(self.last_change + self.debounce, self.first_change + self.max_delay) - now)
+
+    # Returns how long to wait for new files before there's something else to do.
+    def timeout(self):
+        timeout = self.poll
+        due = self.due()
+        if due is not None:
+            timeout = min(timeout, due)
+        if self.waiting:
+            oldest = min(since for since, parent in self.waiting.values())
+            timeout = min(timeout, max(0, oldest + self.grace - time.monotonic()))
+        return timeout
+
+    # Uploads the staged changes, then archives whatever has become final.
+    def flush(self):
+        with self.lock:
+            notifier.resident = self.snapshot
+            staged = self.snapshot.load("staged", {})
+            with metrics.timed("firebase_update"):
+                uploaded, size = notifier.firebase_update(staged, self.backend)
+            metrics.UPLOADED_FORKS.inc(uploaded)
+            metrics.UPLOADED_BYTES.inc(size)
+            self.first_change = None
+            self.last_change = None
+            blockchain = self.snapshot.load("blockchain")
+            if blockchain is not None:
+                with metrics.timed("archive"):
+                    archived_blocks, archived_forks = notifier.archive(blockchain)
+                metrics.ARCHIVED_BLOCKS.inc(archived_blocks)
+                metrics.ARCHIVED_FORKS.inc(archived_forks)
+        metrics.export()
+        if self.printout:
+            print(f"Uploaded {uploaded} changed forks ({size} bytes).")
+
+    def synchronize(self):
+        while not self.stopping.is_set():
+            try:
+                notifier.fetch()
+            except Exception:
+                traceback.print_exc()
+            self.stopping.wait(self.sync_interval)
+
+    # Waits up to 'timeout' seconds for new files, and returns their paths. With 'relist', or without inotify, the
+    # directory is listed for anything not yet ingested instead of trusting the events alone.
+    def wait(self, watch, timeout, relist=False):
+        if watch is not None:
+            names = watch.read(timeout)
+            if names is not None and not relist:
+                return [os.path.join(self.output, name) for name in names if Manifest.eligible(name)]
+        else:
+            self.stopping.wait(timeout)
+        return self.manifest.pending(self.output)
+
+    def run(self):
+        if os.environ.get("METRICS_PORT"):
+            metrics.serve(int(os.environ["METRICS_PORT"]))
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        threads = [threading.Thread(target=self.checkpoints, name="checkpoints", daemon=True)]
+        if self.sync_interval > 0:
+            threads.append(threading.Thread(target=self.synchronize, name="synchronize", daemon=True))
+        for thread in threads:
+            thread.start()
+
+        os.makedirs(self.output, exist_ok=True)
+        try:
+            watch = Inotify(self.output)
+        except OSError:
+            watch = None
+            if self.printout:
+                print(f"inotify unavailable, polling {self.output} every {self.poll} seconds.")
+        # Anything that arrived while we weren't watching is ingested first, all together, as a cycle would
+        files = self.manifest.pending(self.output)
+        while not self.stopping.is_set():
+            relist = False
+            try:
+                if files:
+                    self.ingest(files)
+                if self.due() == 0:
+                    self.flush()
+            except Exception:
+                # As with the daemon, one bad batch shouldn't stop the rest; unparsed files are picked up on the relist
+                traceback.print_exc()
+                relist = True
+            files = self.ready(self.wait(watch, self.timeout(), relist))
+
+        if watch is not None:
+            watch.close()
+        for thread in threads:
+            thread.join()
+        # Files still waiting for their parent won't get another chance before the next start, so take them in as is
+        if self.waiting:
+            self.ingest(list(self.waiting))
+            self.waiting.clear()
+        if self.due() is not None:
+            self.flush()
+        written = self.checkpoint()
+        notifier.resident = None
+        if self.printout:
+            print(f"Stopped after ingesting {self.ingested} Blocks, checkpointed {written} sections.")
+
+
+if __name__ == '__main__':
+    Watcher().run()
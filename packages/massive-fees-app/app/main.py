@@ -14,6 +14,11 @@ import dash_html_components as html
 from dash.dependencies import Input, Output, State
 import dash_core_components as dcc
 import dash_bootstrap_components as dbc
+import fcntl
+import os
+import pickle
+import tempfile
+import time
 
 
 def get_providers():
@@ -25,10 +30,63 @@ def get_providers():
     df = pd.DataFrame(df_data)
     return df
     
+class TransactionStore:
+    """Transactions matched by a MinaExplorer query, kept in a local file (in CACHE_DIR, the temp directory by default)
+    so that each update only asks for those above the highest block height seen so far. The query takes that height
+    as $height and a page size as $limit, and must select each transaction's hash and blockHeight, oldest first.
+    Every 'reconcile_interval' seconds, the last 'depth' blocks below that height are asked for again as well, and
+    replace what's stored for them, which drops any transaction whose block has stopped being canonical since."""
+
+    def __init__(self, name, query, page_size=10000, depth=290, reconcile_interval=None):
+        directory = os.environ.get("CACHE_DIR", tempfile.gettempdir())
+        self.path = os.path.join(directory, f"{name}-transactions.pickle")
+        self.query = query
+        self.page_size = page_size
+        self.depth = depth
+        self.reconcile_interval = reconcile_interval or int(os.environ.get("RECONCILE_INTERVAL", 3600))
+
+    def fetch(self, height):
+        """Return every transaction above the given block height, a page at a time"""
+        transactions = []
+        while True:
+            url = 'https://graphql.minaexplorer.com'
+            r = requests.post(url, json={'query': self.query, 'variables': {'height': height, 'limit': self.page_size}})
+            page = json.loads(r.text)["data"]["transactions"]
+            transactions.extend(page)
+            if len(page) < self.page_size:
+                return transactions
+            # Start the next page back at the last block on this one, in case its transactions were split between them
+            height = page[-1]["blockHeight"] - 1
+
+    def update(self):
+        """Bring the store up to date, and return every transaction in it, newest first"""
+        # One update at a time, whichever thread or worker it's from
+        with open(f"{self.path}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                with open(self.path, "rb") as store:
+                    transactions, reconciled = pickle.load(store)
+            except FileNotFoundError:
+                transactions, reconciled = {}, 0
+            height = max((transaction["blockHeight"] for transaction in transactions.values()), default=0)
+            if time.time() - reconciled > self.reconcile_interval:
+                height = max(0, height - self.depth)
+                transactions = {key: transaction for key, transaction in transactions.items()
+                                if transaction["blockHeight"] <= height}
+                reconciled = time.time()
+            for transaction in self.fetch(height):
+                transactions[transaction["hash"]] = transaction
+            temporary = f"{self.path}.{os.getpid()}"
+            with open(temporary, "wb") as store:
+                pickle.dump((transactions, reconciled), store)
+            os.replace(temporary, self.path)
+        return sorted(transactions.values(), key=lambda transaction: transaction["blockHeight"], reverse=True)
+
 def get_data():
-    query = """query ExpensiveTransactions {
-  transactions(query: {fee_gt: 10000000000, canonical: true}, sortBy: FEE_DESC) {
+    query = """query ExpensiveTransactions($height: Int!, $limit: Int!) {
+  transactions(query: {fee_gt: 10000000000, canonical: true, blockHeight_gt: $height}, sortBy: BLOCKHEIGHT_ASC, limit: $limit) {
     hash
+    blockHeight
     from
     to
     block {
@@ -41,11 +99,9 @@ def get_data():
 """
     providers = get_providers()
     
-    url = 'https://graphql.minaexplorer.com'
-    r = requests.post(url, json={'query': query})
-    json_data = json.loads(r.text)
-    df_data = json_data["data"]["transactions"]
-    df = pd.json_normalize(df_data, sep="_")
+    store = TransactionStore("massive-fees", query)
+    df = pd.json_normalize(store.update(), sep="_")
+    df = df.sort_values("fee", ascending=False, ignore_index=True)
     df["fee"] = df.fee.map(lambda x: x/ (10 ** 9))
     
     res = pd.merge(df, providers, left_on=  ['block_creator'],